@@ -104,12 +104,16 @@ assert ldb.post(chicken_feed)
 assert ldb.post(eggs)
 assert ldb.post(eggs)
 
-# The database copys the items when they are stored/loaded
+# The database stores immutable (frozen) copies and returns them without copying again
 _basf_copy = ldb.get_producer(pub_key=basf.pub_key)
 _grain_copy = ldb.get_product(pub_key=grain.pub_key)
 
 assert _basf_copy.is_valid()
 assert _grain_copy.is_valid()
 
-assert basf.__dict__ == _basf_copy.__dict__
-assert grain.__dict__  == _grain_copy.__dict__
+assert basf.to_dict() == _basf_copy.to_dict()
+assert grain.to_dict() == _grain_copy.to_dict()
+
+# thaw() returns a mutable copy
+_grain_mutable = _grain_copy.thaw()
+_grain_mutable.name = "Better Grain"
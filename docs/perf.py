@@ -1,52 +1,213 @@
+"""Offline benchmarks of grafeo
+
+Everything runs in this process: remote round trips go to a StandInServer
+on localhost, local databases live in a temporary folder. Every benchmark is
+warmed up, then run in repetitions which are long enough to be timed
+reliably. Min, median, mean and standard deviation of the time per call are
+reported, with --output also as json to compare releases:
+
+    python docs/perf.py --output perf.json
+    python docs/perf.py --quick
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import platform
+import tempfile
+import statistics
+
 import grafeo
-from timeit import default_timer as timer
-
-
-db = grafeo.RemoteDB(url='http://localhost:8000')
-
-num_samples = 100
-
-_p = grafeo.Producer(name="Test Producer Timing")
-db.post(_p)
-print(_p.is_valid())
-
-start = timer()
-for i in range(num_samples):
-    _pp = db.get_producer(pub_key=_p.pub_key)
-end = timer()
-print("Producers (GET): {} per second".format(num_samples / (end-start)))
-
-
-start = timer()
-for i in range(num_samples):
-    db.post_producer(
-        name="Test Producer Timing"
-    )
-end = timer()
-print("Producers (Create+Encrytp+Post): {} per second".format(num_samples / (end-start)))
-
-
-# Compley Product
-inputs = [grafeo.new_product(name="Test Product {}".format(j), producer=_p, inputs=[]) for j in range(100)]
-num_samples = 10
-
-start = timer()
-for i in range(num_samples):
-    db.post_product(
-        name="Test Product Complex Timing",
-        producer=_p,
-        inputs=inputs
-    )
-end = timer()
-print("Complex Product (Create+Encrytp+Post): {} per second".format(num_samples / (end-start)))
-
-start = timer()
-for i in range(num_samples):
-    _product = grafeo.new_product(
-        name="Test Product Complex Timing",
-        producer=_p,
-        inputs=inputs
-    )
-    _a = _product.__dict__
-end = timer()
-print("Complex Product (Create+Encrytp): {} per second".format(num_samples / (end-start)))
+from grafeo.crypto import disable_signature_cache
+from grafeo.standin import StandInServer
+
+
+def measure(func, repeat: int, min_time: float, warmup: int):
+    """Times func
+
+    :param func: called without arguments
+    :param repeat: number of timed repetitions
+    :param min_time: every repetition calls func often enough to take at least that many seconds
+    :param warmup: number of untimed calls before
+    :returns statistics of the seconds per call
+    """
+
+    for _ in range(warmup):
+        func()
+
+    # Calibrate the number of calls per repetition like timeit.autorange
+    _number = 1
+    while True:
+        _start = time.perf_counter()
+        for _ in range(_number):
+            func()
+        if time.perf_counter() - _start >= min_time:
+            break
+        _number *= 2
+
+    _times = []
+    for _ in range(repeat):
+        _start = time.perf_counter()
+        for _ in range(_number):
+            func()
+        _times.append((time.perf_counter() - _start) / _number)
+
+    return {
+        'number': _number,
+        'repeat': repeat,
+        'min': min(_times),
+        'median': statistics.median(_times),
+        'mean': statistics.mean(_times),
+        'stdev': statistics.stdev(_times) if len(_times) > 1 else 0.0,
+        'per_second': 1.0 / min(_times)
+    }
+
+
+def _product(producer, inputs):
+    return grafeo.new_product(name='Benchmark Product', producer=producer, inputs=inputs)
+
+
+def _uncached_payload(prod):
+    prod.__dict__.pop('_payload_cache', None)
+    return prod._payload()
+
+
+def _crypto_benchmarks(producer, inputs, input_counts):
+    yield 'generate_key_pair', {}, grafeo.generate_key_pair
+    yield 'Producer.sign', {}, producer.sign
+
+    for _n in input_counts:
+        _prod = _product(producer, inputs[:_n])
+        _input_priv_keys = [_input.priv_key for _input in inputs[:_n]]
+
+        yield 'Product.sign', {'inputs': _n}, \
+            lambda _prod=_prod, _keys=_input_priv_keys: _prod.sign(producer.priv_key, _keys)
+        yield 'Product.is_valid', {'inputs': _n}, _prod.is_valid
+        yield 'Product._payload', {'inputs': _n}, lambda _prod=_prod: _uncached_payload(_prod)
+
+
+def _local_db(folder, producer, products):
+    _db = grafeo.LocalDB(folderpath=folder)
+    # The benchmark writes explicitly, not at exit
+    atexit.unregister(_db._exit)
+    _db._clean()
+
+    assert _db.post(producer)
+    assert all(_db.post_many(products, validate=False))
+    return _db
+
+
+def _load(folder):
+    atexit.unregister(grafeo.LocalDB(folderpath=folder)._exit)
+
+
+def _local_db_benchmarks(folder, producer, inputs, db_sizes):
+    for _size in db_sizes:
+        _products = [_product(producer, inputs[_i % len(inputs):_i % len(inputs) + 2]) for _i in range(_size)]
+        _db = _local_db(folder, producer, _products)
+        _new = _product(producer, inputs[:2])
+
+        _db.compact()
+        yield 'LocalDB.compact', {'db_size': _size}, _db.compact
+        yield 'LocalDB.load', {'db_size': _size}, lambda: _load(folder)
+        yield 'LocalDB.get_product', {'db_size': _size}, \
+            lambda _db=_db, _key=_products[_size // 2].pub_key: _db.get_product(_key)
+        yield 'LocalDB.post', {'db_size': _size}, lambda _db=_db, _new=_new: _db.post(_new)
+        yield 'LocalDB.post+flush', {'db_size': _size}, \
+            lambda _db=_db, _new=_new: _db.post(_new, validate=False) and _db.flush()
+
+
+def _remote_db_benchmarks(url, producer, inputs, input_counts):
+    for _wire in ['json', 'binary']:
+        _db = grafeo.RemoteDB(url=url, wire=_wire)
+        assert _db.post(producer)
+
+        yield 'RemoteDB.get_producer', {'wire': _wire}, lambda _db=_db: _db.get_producer(producer.pub_key)
+
+        for _n in input_counts:
+            _prod = _product(producer, inputs[:_n])
+            assert _db.post(_prod)
+
+            yield 'RemoteDB.get_product', {'wire': _wire, 'inputs': _n}, \
+                lambda _db=_db, _key=_prod.pub_key: _db.get_product(_key)
+            yield 'RemoteDB.post', {'wire': _wire, 'inputs': _n}, lambda _db=_db, _prod=_prod: _db.post(_prod)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(description='Offline benchmarks of grafeo')
+    _parser.add_argument('--inputs', default='0,10,100,1000', help='comma separated input counts of products')
+    _parser.add_argument('--db-sizes', default='100,1000,10000', help='comma separated numbers of products in LocalDB')
+    _parser.add_argument('--repeat', type=int, default=5, help='timed repetitions per benchmark')
+    _parser.add_argument('--min-time', type=float, default=0.1, help='minimal seconds per repetition')
+    _parser.add_argument('--warmup', type=int, default=3, help='untimed calls before timing')
+    _parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    _parser.add_argument('--quick', action='store_true', help='small sizes and short repetitions, for smoke tests')
+    _parser.add_argument('--output', help='write the results as json to this file')
+    _args = _parser.parse_args(argv)
+
+    _input_counts = [int(_n) for _n in _args.inputs.split(',')]
+    _db_sizes = [int(_n) for _n in _args.db_sizes.split(',')]
+    if _args.quick:
+        _input_counts = [_n for _n in _input_counts if _n <= 10]
+        _db_sizes = [_n for _n in _db_sizes if _n <= 100]
+        _args.repeat, _args.min_time, _args.warmup = 3, 0.01, 1
+
+    # Otherwise is_valid would only measure cache lookups
+    disable_signature_cache()
+
+    _producer = grafeo.Producer(name='Benchmark Producer')
+    _inputs = [
+        grafeo.new_product(name='Input {}'.format(_i), producer=_producer, inputs=[])
+        for _i in range(max(_input_counts + [2]))
+    ]
+
+    _results = []
+
+    with tempfile.TemporaryDirectory() as _folder, StandInServer() as _server:
+        _benchmarks = [
+            _crypto_benchmarks(_producer, _inputs, _input_counts),
+            _local_db_benchmarks(_folder, _producer, _inputs, _db_sizes),
+            _remote_db_benchmarks(_server.url, _producer, _inputs, _input_counts)
+        ]
+
+        for _name, _params, _func in (_b for _group in _benchmarks for _b in _group):
+            if _args.filter not in _name:
+                continue
+
+            _stats = measure(_func, repeat=_args.repeat, min_time=_args.min_time, warmup=_args.warmup)
+            _results.append({'name': _name, 'params': _params, 'stats': _stats})
+
+            print('{:<24} {:<28} {:>12.1f} us  (+- {:.1f})  {:>10.1f} per second'.format(
+                _name,
+                ' '.join('{}={}'.format(_k, _v) for _k, _v in sorted(_params.items())),
+                _stats['median'] * 1e6,
+                _stats['stdev'] * 1e6,
+                _stats['per_second']
+            ))
+            sys.stdout.flush()
+
+    if _args.output:
+        with open(_args.output, 'w') as _f:
+            json.dump({
+                'machine': {
+                    'python': platform.python_version(),
+                    'implementation': platform.python_implementation(),
+                    'platform': platform.platform(),
+                    'processor': platform.processor(),
+                    'cpus': os.cpu_count()
+                },
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'settings': {
+                    'repeat': _args.repeat,
+                    'min_time': _args.min_time,
+                    'warmup': _args.warmup
+                },
+                'results': _results
+            }, _f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
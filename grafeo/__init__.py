@@ -1,22 +1,36 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Tuple, Any
 from .common import *
 from .crypto import (
     generate_key_pair,
+    generate_key_pairs,
+    pooled_key_pair,
+    enable_key_pool,
+    disable_key_pool,
     check_utf8_string,
     check_pub_key,
     check_priv_key,
     check_signature,
+    find_invalid_pub_key,
+    find_invalid_signature,
     validate_signed_message,
-    sign_message
+    validate_signed_messages,
+    find_invalid_signed_message,
+    derive_pub_key,
+    sign_message,
+    sign_messages,
+    clear_signing_keys
 )
 import abc
 import warnings
 import requests
+import requests.adapters
+from urllib3.util.retry import Retry
 import os
 import pickle
-import copy
 import pprint
 import atexit
+import threading
+from . import instrument
 
 
 class BaseProd(object):
@@ -50,12 +64,16 @@ class BaseProd(object):
         self.signature = signature  # type: str
 
     def _generate_key_pair(self):
-        """Generates a public, private key pair for the produc(er/t)"""
-        _pair = generate_key_pair()  # type: Dict[str, str]
+        """Generates a public, private key pair for the produc(er/t), or takes one from the key pool"""
+        _pair = pooled_key_pair()  # type: Dict[str, str]
 
         self.pub_key = _pair['pub_key']
         self.priv_key = _pair['priv_key']
 
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the fields of the produc(er/t) as they are sent to a remote database"""
+        return {_k: _v for _k, _v in self.__dict__.items() if not _k.startswith('_')}
+
     @abc.abstractmethod
     def __str__(self):
         """string representation"""
@@ -70,8 +88,53 @@ class BaseProd(object):
         pass
 
     @abc.abstractmethod
+    def _is_well_formed(self) -> bool:
+        """Checks the format of all fields, but not the signatures"""
+        pass
+
     def _payload(self) -> str:
         """Turns the class into the specified string"""
+        return self._cached_payload()[0]
+
+    def _payload_bytes(self) -> bytes:
+        """The payload encoded as utf-8, this is what is actually signed"""
+        return self._cached_payload()[1]
+
+    def _cached_payload(self) -> Tuple[str, bytes]:
+        """Returns the payload and its encoding, both are only rebuilt if a payload field changed"""
+
+        _fields = self._payload_fields()  # type: Tuple[Any, ...]
+        _cache = self.__dict__.get('_payload_cache')
+
+        if _cache is None or _cache[0] != _fields:
+            with instrument.timer('payload.build'):
+                _payload = self._build_payload()  # type: str
+                _cache = (_fields, _payload, _payload.encode('utf-8'))
+            self.__dict__['_payload_cache'] = _cache
+
+        return _cache[1], _cache[2]
+
+    def __getstate__(self):
+        # The payload cache is rebuilt on demand and not worth storing
+        _state = dict(self.__dict__)
+        _state.pop('_payload_cache', None)
+        return _state
+
+    @abc.abstractmethod
+    def _payload_fields(self) -> Tuple[Any, ...]:
+        """Returns everything the payload is built from"""
+        pass
+
+    @abc.abstractmethod
+    def _build_payload(self) -> str:
+        """Builds the payload from scratch"""
+        pass
+
+    @abc.abstractmethod
+    def _signed_messages(self) -> List[Tuple[str, bytes, str]]:
+        """Returns all (pub_key, message, signature) triples
+        which have to be valid for the produc(er/t) to be valid
+        """
         pass
 
 
@@ -101,6 +164,7 @@ class Producer(BaseProd):
     def __str__(self):
             return "Producer: " + self.name
 
+    @instrument.timed('Producer.is_valid')
     def is_valid(self):
         """Checks if the Producer is valid
 
@@ -108,24 +172,13 @@ class Producer(BaseProd):
         """
 
         try:
-            # Check public key (also done in validate_signed_message)
-            if not check_pub_key(self.pub_key):
-                return False
-
-            # Check name
-            if not check_utf8_string(self.name):
-                return False
-
-            # Check signature (also done in validate_signed_message)
-            if not check_signature(self.signature):
-                return False
+            # Check format
+            with instrument.timer('is_well_formed'):
+                if not self._is_well_formed():
+                    return False
 
             # Check data integrity
-            if not validate_signed_message(
-                pub_key=self.pub_key,
-                message=self._payload(),
-                signature=self.signature
-            ):
+            if not validate_signed_messages(self._signed_messages()):
                 return False
 
             return True
@@ -135,30 +188,50 @@ class Producer(BaseProd):
             # If anything goes wrong this is not valid
             return False
 
+    def _is_well_formed(self) -> bool:
+        """Checks the format of all fields of the producer, but not the signature itself"""
+
+        # Check public key (also done in validate_signed_message)
+        if not check_pub_key(self.pub_key):
+            return False
+
+        # Check name
+        if not check_utf8_string(self.name):
+            return False
+
+        # Check signature (also done in validate_signed_message)
+        if not check_signature(self.signature):
+            return False
+
+        return True
+
     def sign(self) -> bool:
         if not check_priv_key(self.priv_key):
             warnings.warn('This producer has no valid private key and can thus not generate a signature.')
             return False
 
-        _payload = self._payload()  # type: str
+        _payload = self._payload_bytes()  # type: bytes
 
         if not _payload:
             warnings.warn('Thos producers payload is not valid')
             return False
 
-        _signature = sign_message(priv_key=self.priv_key, message=_payload)  # type: str
-
-        # Fill Signature
-        self.signature = _signature
-
-        if not self.is_valid():
+        # A signature from the matching private key over a well formed payload is valid,
+        # so there is no need to verify it again afterwards
+        if derive_pub_key(self.priv_key) != self.pub_key:
             warnings.warn('The created signature was not valid')
             self.signature = ''
             return False
 
+        # Fill Signature
+        self.signature = sign_message(priv_key=self.priv_key, message=_payload)
+
         return True
 
-    def _payload(self) -> str:
+    def _payload_fields(self) -> Tuple[Any, ...]:
+        return self.pub_key, self.version_major, self.version_minor, self.version_patch, self.name
+
+    def _build_payload(self) -> str:
         """Returns the payload associated with a producer"""
 
         if not check_pub_key(self.pub_key):
@@ -178,6 +251,11 @@ class Producer(BaseProd):
             ]),
             self.name])
 
+    def _signed_messages(self) -> List[Tuple[str, bytes, str]]:
+        """Returns the (pub_key, message, signature) triples which make up the producer"""
+
+        return [(self.pub_key, self._payload_bytes(), self.signature)]
+
 
 class Product(BaseProd):
     """Database Model of a Product"""
@@ -217,6 +295,7 @@ class Product(BaseProd):
     def __str__(self) -> str:
         return "Product: " + self.name
 
+    @instrument.timed('Product.is_valid')
     def is_valid(self) -> bool:
         """Checks if the product is valid
 
@@ -224,73 +303,67 @@ class Product(BaseProd):
         """
 
         try:
-            # Check public key
-            if not check_pub_key(self.pub_key):
-                return False
+            # Check format
+            with instrument.timer('is_well_formed'):
+                if not self._is_well_formed():
+                    return False
 
-            # Check name
-            if not check_utf8_string(self.name):
+            # Check data integrity (all signatures in one batch)
+            if not validate_signed_messages(self._signed_messages()):
                 return False
 
-            # Check Inputs
-            try:
-                num_inputs = len(self.input_pub_keys)  # type: int
-            except TypeError:
-                num_inputs = 0
-
-            try:
-                _num_inputs = len(self.input_signatures)  # type: int
-            except TypeError:
-                _num_inputs = 0
+            return True
 
-            if num_inputs != _num_inputs:
-                return False
+        except:
 
-            # Check Signatures
-            if not check_signature(self.signature):
-                return False
+            # If anything goes wrong this is not valid
+            return False
 
-            if not check_signature(self.producer_signature):
-                return False
+    def _is_well_formed(self) -> bool:
+        """Checks the format of all fields of the product, but not the signatures themselves"""
 
-            if num_inputs > 0:
-                for _sig in self.input_signatures:
-                    if not check_signature(_sig):
-                        return False
+        # Check public key
+        if not check_pub_key(self.pub_key):
+            return False
 
-            # Check data integrity
-            _message = self._payload()  # type: str
+        # Check name
+        if not check_utf8_string(self.name):
+            return False
 
-            if not validate_signed_message(
-                pub_key=self.pub_key,
-                message=_message,
-                signature=self.signature
-            ):
-                return False
+        # Check Producer
+        if not check_pub_key(self.producer_pub_key):
+            return False
 
-            if not validate_signed_message(
-                pub_key=self.producer_pub_key,
-                message=_message,
-                signature=self.producer_signature
-            ):
-                return False
+        # Check Inputs
+        try:
+            num_inputs = len(self.input_pub_keys)  # type: int
+        except TypeError:
+            num_inputs = 0
 
-            if num_inputs > 0:
-                for _pub_key, _sig in zip(self.input_pub_keys, self.input_signatures):
-                    if not validate_signed_message(
-                        pub_key=_pub_key,
-                        message=_message,
-                        signature=_sig
-                    ):
-                        return False
+        try:
+            _num_inputs = len(self.input_signatures)  # type: int
+        except TypeError:
+            _num_inputs = 0
 
-            return True
+        if num_inputs != _num_inputs:
+            return False
 
-        except:
+        # Check Signatures
+        if not check_signature(self.signature):
+            return False
 
-            # If anything goes wrong this is not valid
+        if not check_signature(self.producer_signature):
             return False
 
+        if num_inputs > 0:
+            if find_invalid_pub_key(self.input_pub_keys) != -1:
+                return False
+
+            if find_invalid_signature(self.input_signatures) != -1:
+                return False
+
+        return True
+
     def sign(self, producer_priv_key: str, input_priv_keys: List[str]) -> bool:
 
         # Check self
@@ -325,44 +398,35 @@ class Product(BaseProd):
             return False
 
         if _num_inputs1 > 0:
-            for _pub_key in self.input_pub_keys:
-                if not check_pub_key(_pub_key):
-                    return False
-
-            for _priv_key in input_priv_keys:
-                if not check_pub_key(_priv_key):
-                    return False
+            if find_invalid_pub_key(self.input_pub_keys) != -1:
+                return False
 
-        # Sign of everything
-        _message = self._payload()  # type: str
+            # Private keys have the same format as public keys
+            if find_invalid_pub_key(input_priv_keys) != -1:
+                return False
 
-        # Own key
-        self.signature = sign_message(
-            priv_key=self.priv_key,
-            message=_message
-        )
+        # Check that every private key belongs to its public key. Then the signatures
+        # are valid by construction and the done product needs no further check
+        _priv_keys = [self.priv_key, producer_priv_key] + list(input_priv_keys or [])  # type: List[str]
+        _pub_keys = [self.pub_key, self.producer_pub_key] + list(self.input_pub_keys)  # type: List[str]
 
-        # Producer key
-        self.producer_signature = sign_message(
-            priv_key=producer_priv_key,
-            message=_message
-        )
+        if [derive_pub_key(_priv_key) for _priv_key in _priv_keys] != _pub_keys:
+            return False
 
-        # Input keys
-        self.input_signatures = [
-            sign_message(
-                priv_key=_priv_key,
-                message=_message
-            ) for _priv_key in input_priv_keys
-        ]
+        # Sign of everything, own key, producer key and input keys
+        _signatures = sign_messages(priv_keys=_priv_keys, message=self._payload_bytes())  # type: List[str]
 
-        # Check done product
-        if not self.is_valid():
-            return False
+        self.signature = _signatures[0]
+        self.producer_signature = _signatures[1]
+        self.input_signatures = _signatures[2:]
 
         return True
 
-    def _payload(self) -> str:
+    def _payload_fields(self) -> Tuple[Any, ...]:
+        return (self.pub_key, self.version_major, self.version_minor, self.version_patch, self.name,
+                self.producer_pub_key, tuple(self.input_pub_keys))
+
+    def _build_payload(self) -> str:
         """Returns the payload associated with this product"""
 
         return separators.field.join([
@@ -377,6 +441,161 @@ class Product(BaseProd):
             separators.list.join(self.input_pub_keys),
         ])
 
+    def _signed_messages(self) -> List[Tuple[str, bytes, str]]:
+        """Returns the (pub_key, message, signature) triples which make up the product
+
+        The product key, the producer key and every input key sign the same payload.
+        """
+
+        _message = self._payload_bytes()  # type: bytes
+
+        _triples = [
+            (self.pub_key, _message, self.signature),
+            (self.producer_pub_key, _message, self.producer_signature)
+        ]  # type: List[Tuple[str, bytes, str]]
+        _triples.extend(
+            (_pub_key, _message, _sig) for _pub_key, _sig in zip(self.input_pub_keys, self.input_signatures)
+        )
+
+        return _triples
+
+
+class _Frozen(object):
+    """Mixin which makes a produc(er/t) immutable and compact
+
+    Frozen records can be shared freely, e.g. a database can hand out the
+    stored instance itself instead of a deep copy. Use thaw() to get a
+    mutable copy.
+
+    Keys and signatures are kept as raw bytes in slots, the hex-strings are
+    only built when the attributes are read. This only works for well formed
+    produc(er/t)s, so freezing anything else raises a ValueError.
+    """
+
+    __slots__ = ()
+    _fields = ()  # type: Tuple[str, ...]
+    _thawed = None  # the mutable class
+
+    def __init__(self, **fields):
+        _prod = self._thawed(**{_k: _v for _k, _v in fields.items() if _k != 'priv_key'})
+
+        if not _prod._is_well_formed() or not (fields['priv_key'] == '' or check_priv_key(fields['priv_key'])):
+            raise ValueError('Only well formed produc(er/t)s can be frozen')
+
+        _set = object.__setattr__
+        _set(self, '_pub_key', bytes.fromhex(fields['pub_key']))
+        _set(self, '_priv_key', bytes.fromhex(fields['priv_key']))
+        _set(self, 'version_major', fields['version_major'])
+        _set(self, 'version_minor', fields['version_minor'])
+        _set(self, 'version_patch', fields['version_patch'])
+        _set(self, 'name', fields['name'])
+        _set(self, '_signature', bytes.fromhex(fields['signature']))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} is immutable, use thaw() to get a mutable copy'.format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('{} is immutable, use thaw() to get a mutable copy'.format(type(self).__name__))
+
+    def __reduce__(self):
+        return _unpickle_frozen, (type(self), self.to_dict())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _cached_payload(self) -> Tuple[str, bytes]:
+        # Frozen records are kept small, so their payload is not cached
+        _payload = self._build_payload()  # type: str
+        return _payload, _payload.encode('utf-8')
+
+    pub_key = property(lambda self: self._pub_key.hex())
+    priv_key = property(lambda self: self._priv_key.hex())
+    signature = property(lambda self: self._signature.hex())
+
+    def to_dict(self) -> Dict[str, Any]:
+        _dict = {_field: getattr(self, _field) for _field in self._fields}  # type: Dict[str, Any]
+        for _field, _value in _dict.items():
+            if isinstance(_value, tuple):
+                _dict[_field] = list(_value)
+        return _dict
+
+    def thaw(self):
+        """Returns a mutable copy"""
+
+        _dict = self.to_dict()  # type: Dict[str, Any]
+        _priv_key = _dict.pop('priv_key')  # type: str
+
+        _prod = self._thawed(**_dict)
+        _prod.priv_key = _priv_key
+        return _prod
+
+
+def _unpickle_frozen(cls, fields: Dict[str, Any]):
+    return cls(**fields)
+
+
+class FrozenProducer(_Frozen, Producer):
+    """Immutable Producer, see _Frozen"""
+
+    __slots__ = ('_pub_key', '_priv_key', 'version_major', 'version_minor', 'version_patch', 'name', '_signature')
+    _fields = ('pub_key', 'priv_key', 'version_major', 'version_minor', 'version_patch', 'name', 'signature')
+    _thawed = Producer
+
+
+class FrozenProduct(_Frozen, Product):
+    """Immutable Product, see _Frozen
+
+    The input keys and signatures are packed into one buffer, first all
+    32 byte keys, then all 64 byte signatures. They are returned as tuples.
+    """
+
+    __slots__ = FrozenProducer.__slots__ + ('_producer_pub_key', '_producer_signature', '_inputs')
+    _fields = FrozenProducer._fields + (
+        'producer_pub_key', 'producer_signature', 'input_pub_keys', 'input_signatures'
+    )
+    _thawed = Product
+
+    def __init__(self, **fields):
+        _Frozen.__init__(self, **fields)
+
+        _set = object.__setattr__
+        _set(self, '_producer_pub_key', bytes.fromhex(fields['producer_pub_key']))
+        _set(self, '_producer_signature', bytes.fromhex(fields['producer_signature']))
+        _set(self, '_inputs', bytes.fromhex(
+            ''.join(fields['input_pub_keys'] or ()) + ''.join(fields['input_signatures'] or ())
+        ))
+
+    producer_pub_key = property(lambda self: self._producer_pub_key.hex())
+    producer_signature = property(lambda self: self._producer_signature.hex())
+
+    @property
+    def input_pub_keys(self) -> Tuple[str, ...]:
+        _inputs = self._inputs  # type: bytes
+        return tuple(_inputs[_i:_i + 32].hex() for _i in range(0, len(_inputs) // 3, 32))
+
+    @property
+    def input_signatures(self) -> Tuple[str, ...]:
+        _inputs = self._inputs  # type: bytes
+        return tuple(_inputs[_i:_i + 64].hex() for _i in range(len(_inputs) // 3, len(_inputs), 64))
+
+
+def freeze(prod: BaseProd) -> BaseProd:
+    """Returns an immutable version of a produc(er/t), frozen ones are returned as they are"""
+
+    if isinstance(prod, _Frozen):
+        return prod
+
+    if isinstance(prod, Producer):
+        return FrozenProducer(**prod.to_dict())
+
+    if isinstance(prod, Product):
+        return FrozenProduct(**prod.to_dict())
+
+    raise TypeError('Only producers and products can be frozen')
+
 
 def new_product(name: str, producer: Producer, inputs: List[Product]) -> Product:
     product = Product(
@@ -393,6 +612,36 @@ def new_product(name: str, producer: Producer, inputs: List[Product]) -> Product
     return product
 
 
+def validate_many(prods: List[BaseProd]) -> List[bool]:
+    """Checks many produc(er/t)s at once
+
+    The signatures of all well formed produc(er/t)s are verified in one batch.
+    Only if the batch fails, every produc(er/t) is checked on its own to find
+    the invalid ones.
+
+    :param prods: the produc(er/t)s to check
+    :returns for each produc(er/t) True if it is valid
+    """
+
+    _results = []  # type: List[bool]
+    _triples = []  # type: List[Tuple[str, bytes, str]]
+
+    for _prod in prods:
+        try:
+            _well_formed = _prod._is_well_formed()  # type: bool
+            if _well_formed:
+                _triples.extend(_prod._signed_messages())
+        except:
+            _well_formed = False
+
+        _results.append(_well_formed)
+
+    if validate_signed_messages(_triples):
+        return _results
+
+    return [_well_formed and _prod.is_valid() for _prod, _well_formed in zip(prods, _results)]
+
+
 class BaseDB(abc.ABC):
     """Base class for a local or remote database connection"""
 
@@ -407,14 +656,75 @@ class BaseDB(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def post(self, prod: BaseProd) -> bool:
-        """Post a producer or product to the database"""
+    def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        """Post a producer or product to the database
+
+        :param validate: only set this to False for produc(er/t)s which were validated before
+        """
         pass
 
+    def post_many(self, prods: List[BaseProd], validate: bool = True) -> List[bool]:
+        """Post many producers and products to the database, by default one after the other
+
+        :returns for each produc(er/t) True if it was stored
+        """
+        return [self.post(_prod, validate=validate) for _prod in prods]
+
+
+_ACCEPT_BINARY = 'application/x-grafeo, application/json;q=0.5'
+
+
+def _is_binary(response) -> bool:
+    """Whether a response carries records in the binary format of grafeo.wire"""
+    return response.headers.get('Content-Type', '').split(';')[0].strip() == wire.CONTENT_TYPE
+
 
 class RemoteDB(BaseDB):
 
-    def __init__(self, url: str):
+    def __init__(self,
+                 url: str,
+                 pool_size: int = 10,
+                 timeout: float = 10.0,
+                 retries: int = 3,
+                 backoff_factor: float = 0.1,
+                 chunk_size: int = 100,
+                 wire: str = 'json',
+                 cache_dir: str = None,
+                 cache_size: int = 64 << 20,
+                 lazy: bool = False):
+        """Connect to a remote database
+
+        All requests go through one keep-alive session, so connections to the
+        server are reused instead of being opened for every call.
+
+        With wire='binary' records are sent in the compact format of grafeo.wire
+        and requested with an Accept header. Servers which answer with json are
+        understood as well, servers which reject binary bodies with 415 are sent
+        json from then on. The binary format never carries private keys.
+
+        With a cache_dir every verified record is also kept in a DiskCache in
+        that folder. Later gets, also from other processes, are answered from
+        there without a request and without checking signatures again.
+
+        With lazy=True get_* and get_many_* do not check signatures, they
+        return LazyRecords which check them on first use of anything but the
+        public key, name and version. Use this for listings and displays only.
+
+        :param url: base url of the server
+        :param pool_size: maximal number of connections kept open to the server
+        :param timeout: timeout in seconds for connecting and for reading a response
+        :param retries: how often failed connections and 502/503/504 responses are retried
+        :param backoff_factor: retry i waits backoff_factor * 2^(i-1) seconds
+        :param chunk_size: maximal number of records sent to or requested from a bulk endpoint at once
+        :param wire: 'json' or 'binary', the format records are exchanged in
+        :param cache_dir: folder of a persistent cache of verified records, None for no cache
+        :param cache_size: maximal size in bytes of the records in the persistent cache
+        :param lazy: return LazyRecords which are only verified on demand
+        """
+
+        if wire not in ('json', 'binary'):
+            raise ValueError("wire must be 'json' or 'binary'")
+
         self.url = list(url)
 
         if self.url[-1] == '/':
@@ -422,66 +732,321 @@ class RemoteDB(BaseDB):
         else:
             self.url = ''.join(self.url)
 
+        self.timeout = timeout  # type: float
+        self.chunk_size = chunk_size  # type: int
+
+        # Whether the server has bulk endpoints, None until we know
+        self._bulk = None  # type: bool
+
+        # Whether binary records are sent, switched off once the server rejects them
+        self._binary = wire == 'binary'  # type: bool
+
+        self._cache = None if cache_dir is None else DiskCache(cache_dir, max_bytes=cache_size)
+        self.lazy = lazy  # type: bool
+
+        _adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False
+            )
+        )
+
+        self._session = requests.Session()  # type: requests.Session
+        self._session.mount('http://', _adapter)
+        self._session.mount('https://', _adapter)
+
+    def close(self):
+        """Closes all pooled connections and the persistent cache"""
+        self._session.close()
+        if self._cache is not None:
+            self._cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def get_producer(self, pub_key: str):
-        if not check_pub_key(pub_key):
-            return None
+        return self._get_verified(Producer, self._get_producer, pub_key)
 
-        try:
-            _r = requests.get(self.url + "/api/producer/" + pub_key + ".json")
-        except requests.RequestException:
-            return None
+    def get_product(self, pub_key: str):
+        return self._get_verified(Product, self._get_product, pub_key)
 
-        if str(_r.status_code)[0] != '2':
+    def _get_verified(self, cls, fetch, pub_key: str):
+        _prod = self._from_cache(cls, pub_key)
+        if _prod is not None:
+            return LazyRecord(_prod, valid=True) if self.lazy else _prod
+
+        _prod = fetch(pub_key)
+        if _prod is not None and _prod.pub_key != pub_key:
+            _prod = None
+
+        if _prod is not None and self.lazy:
+            return LazyRecord(_prod)
+
+        if _prod is None or not _prod.is_valid():
             return None
 
-        producer = Producer(**_r.json())  # type: Producer
+        self._to_cache([_prod])
+        return _prod
+
+    def _from_cache(self, cls, pub_key: str):
+        """Returns the verified record from the persistent cache or None, also for malformed keys"""
 
-        if not producer.is_valid():
+        if self._cache is None or not check_pub_key(pub_key):
             return None
 
-        return producer
+        return self._cache.get(cls, pub_key)
 
-    def get_product(self, pub_key: str):
+    def _to_cache(self, prods: List[BaseProd]):
+        """Puts verified records into the persistent cache"""
+        if self._cache is not None and prods:
+            self._cache.put_many(prods)
+
+    @instrument.timed('RemoteDB.post')
+    def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        if validate and not prod.is_valid():
+            return False
+
+        if not self._post(prod):
+            return False
+
+        if validate:
+            self._to_cache([prod])
+        return True
+
+    def _get_producer(self, pub_key: str):
+        """Fetches a producer without validating it"""
+        return self._get(Producer, "/api/producer/", pub_key)
+
+    def _get_product(self, pub_key: str):
+        """Fetches a product without validating it"""
+        return self._get(Product, "/api/product/", pub_key)
+
+    def _get(self, cls, path: str, pub_key: str):
         if not check_pub_key(pub_key):
             return None
 
         try:
-            _r = requests.get(self.url + "/api/product/" + pub_key + ".json")
+            with instrument.timer('remotedb.get'):
+                _r = self._session.get(self.url + path + pub_key + ".json", headers=self._accept(), timeout=self.timeout)
         except requests.RequestException:
             return None
 
         if str(_r.status_code)[0] != '2':
             return None
 
-        product = Product(**_r.json())  # type: Product
+        if _is_binary(_r):
+            try:
+                _prod = wire.decode(_r.content)
+            except ValueError:
+                return None
+        else:
+            try:
+                _data = _r.json()
+                # Without a public key the constructor would make up a new, validly signed record
+                _prod = cls(**_data) if isinstance(_data, dict) and _data.get('pub_key') else None
+            except (ValueError, TypeError):
+                return None
 
-        if not product.is_valid():
-            return None
+        # The server must answer with exactly the requested record
+        return _prod if isinstance(_prod, cls) and _prod.pub_key == pub_key else None
 
-        return product
+    def _accept(self) -> Dict[str, str]:
+        """Headers which ask the server for binary records if we speak the binary format"""
+        return {'Accept': _ACCEPT_BINARY} if self._binary else {}
 
-    def post(self, prod: BaseProd) -> bool:
-        if not prod.is_valid():
-            return False
+    def _post(self, prod: BaseProd) -> bool:
+        """Posts a produc(er/t) without validating it"""
 
         if isinstance(prod, Producer):
-            _r = requests.post(
-                url= self.url + "/api/producer/",
-                json=prod.__dict__
-            )
+            _url = self.url + "/api/producer/"
         elif isinstance(prod, Product):
-            _r = requests.post(
-                url= self.url + "/api/product/",
-                json=prod.__dict__
-            )
+            _url = self.url + "/api/product/"
         else:
             return False
 
+        if self._binary:
+            try:
+                with instrument.timer('remotedb.post'):
+                    _r = self._session.post(
+                        url=_url,
+                        data=wire.encode(prod),
+                        headers={'Content-Type': wire.CONTENT_TYPE},
+                        timeout=self.timeout
+                    )
+            except (ValueError, requests.RequestException):
+                return False
+
+            if _r.status_code != 415:
+                return str(_r.status_code)[0] == '2'
+
+            self._binary = False
+
+        try:
+            with instrument.timer('remotedb.post'):
+                _r = self._session.post(url=_url, json=prod.to_dict(), timeout=self.timeout)
+        except requests.RequestException:
+            return False
+
         if str(_r.status_code)[0] != '2':
             return False
 
         return True
 
+    def get_many_producers(self, pub_keys: List[str]) -> List[Any]:
+        """Gets many producers with as few requests as possible
+
+        :returns the producers in the order of pub_keys, None for missing or invalid ones
+        """
+        return self._get_many(Producer, "/api/producer/", pub_keys)
+
+    def get_many_products(self, pub_keys: List[str]) -> List[Any]:
+        """Gets many products with as few requests as possible
+
+        :returns the products in the order of pub_keys, None for missing or invalid ones
+        """
+        return self._get_many(Product, "/api/product/", pub_keys)
+
+    def post_many(self, prods: List[BaseProd], validate: bool = True) -> List[bool]:
+        """Posts many produc(er/t)s with as few requests as possible
+
+        All produc(er/t)s are validated together first, the valid ones are
+        then sent in chunks of chunk_size to the bulk endpoint of the server.
+        Servers without bulk endpoints get one request per produc(er/t).
+
+        :returns for each produc(er/t) True if it was valid and accepted by the server
+        """
+
+        if validate:
+            _results = validate_many(prods)  # type: List[bool]
+        else:
+            _results = [isinstance(_prod, (Producer, Product)) for _prod in prods]
+
+        for _cls, _path in [(Producer, "/api/producer/"), (Product, "/api/product/")]:
+            _indices = [
+                _i for _i, _prod in enumerate(prods) if _results[_i] and isinstance(_prod, _cls)
+            ]  # type: List[int]
+
+            for _start in range(0, len(_indices), self.chunk_size):
+                _chunk = _indices[_start:_start + self.chunk_size]
+                _sent = self._bulk_request(
+                    _path + "bulk/",
+                    lambda: self._records_payload([prods[_i] for _i in _chunk]),
+                    lambda _i: self._post(prods[_i]),
+                    _chunk
+                )
+
+                for _i, _ok in zip(_chunk, _sent):
+                    _results[_i] = bool(_ok)
+
+        if validate:
+            self._to_cache([_prod for _prod, _ok in zip(prods, _results) if _ok])
+
+        return _results
+
+    def _get_many(self, cls, path: str, pub_keys: List[str]) -> List[Any]:
+        _prods = [self._from_cache(cls, _pub_key) for _pub_key in pub_keys]  # type: List[Any]
+        _indices = [
+            _i for _i, _pub_key in enumerate(pub_keys) if _prods[_i] is None and check_pub_key(_pub_key)
+        ]  # type: List[int]
+
+        for _start in range(0, len(_indices), self.chunk_size):
+            _chunk = _indices[_start:_start + self.chunk_size]
+            _records = self._bulk_request(
+                path + "lookup/",
+                lambda: [pub_keys[_i] for _i in _chunk],
+                lambda _i: self._get(cls, path, pub_keys[_i]),
+                _chunk
+            )
+
+            for _i, _record in zip(_chunk, _records):
+                if isinstance(_record, dict):
+                    try:
+                        _record = cls(**_record)
+                    except TypeError:
+                        _record = None
+
+                # The server must answer with exactly the requested record
+                if isinstance(_record, cls) and _record.pub_key == pub_keys[_i]:
+                    _prods[_i] = _record
+
+        _fetched = [_i for _i in _indices if _prods[_i] is not None]  # type: List[int]
+
+        if self.lazy:
+            _indices = set(_indices)
+            return [
+                None if _prod is None else LazyRecord(_prod, valid=None if _i in _indices else True)
+                for _i, _prod in enumerate(_prods)
+            ]
+
+        for _i, _valid in zip(_fetched, validate_many([_prods[_i] for _i in _fetched])):
+            if not _valid:
+                _prods[_i] = None
+
+        self._to_cache([_prods[_i] for _i in _fetched if _prods[_i] is not None])
+        return _prods
+
+    def _records_payload(self, prods: List[BaseProd]) -> Any:
+        """A batch frame of the produc(er/t)s if we speak the binary format, a json array otherwise"""
+
+        if self._binary:
+            try:
+                return wire.encode_batch(prods)
+            except ValueError:
+                pass
+
+        return [_prod.to_dict() for _prod in prods]
+
+    def _bulk_request(self, path: str, payload, fallback, items: List[Any]) -> List[Any]:
+        """Sends one chunk to a bulk endpoint
+
+        :param path: path of the bulk endpoint
+        :param payload: returns the json array or binary batch frame which is posted to the endpoint
+        :param fallback: called for every item if the server has no bulk endpoints
+        :param items: the items the payload was made of
+        :returns one result per item
+        """
+
+        while self._bulk is not False:
+            _payload = payload()
+            if isinstance(_payload, bytes):
+                _kwargs = {'data': _payload, 'headers': dict(self._accept(), **{'Content-Type': wire.CONTENT_TYPE})}
+            else:
+                _kwargs = {'json': _payload, 'headers': self._accept()}
+
+            try:
+                with instrument.timer('remotedb.post'):
+                    _r = self._session.post(url=self.url + path, timeout=self.timeout, **_kwargs)
+            except requests.RequestException:
+                return [None] * len(items)
+
+            if _r.status_code == 415 and isinstance(_payload, bytes):
+                # The server does not understand binary bodies, send the chunk again as json
+                self._binary = False
+            elif _r.status_code in (404, 405, 501):
+                self._bulk = False
+            elif str(_r.status_code)[0] != '2':
+                return [None] * len(items)
+            else:
+                try:
+                    _results = wire.decode_batch(_r.content) if _is_binary(_r) else _r.json()
+                except ValueError:
+                    _results = None
+
+                if not isinstance(_results, list) or len(_results) != len(items):
+                    return [None] * len(items)
+
+                self._bulk = True
+                return _results
+
+        return [fallback(_item) for _item in items]
+
     def post_producer(self, name: str) -> bool:
         _producer = Producer(name=name)
         return self.post(_producer)
@@ -491,63 +1056,318 @@ class RemoteDB(BaseDB):
         return self.post(_product)
 
 
+def _delta_files(filename: str) -> List[Tuple[int, str]]:
+    """Returns (number, path) of all delta files of a LocalDB snapshot, oldest first"""
+
+    _folder, _prefix = os.path.split(filename)
+    _prefix += '.delta.'
+    _deltas = []  # type: List[Tuple[int, str]]
+
+    for _name in os.listdir(_folder or '.'):
+        if _name.startswith(_prefix) and _name[len(_prefix):].isdigit():
+            _deltas.append((int(_name[len(_prefix):]), os.path.join(_folder, _name)))
+
+    return sorted(_deltas)
+
+
+def _write_atomically(filename: str, data: Any) -> int:
+    """Pickles data to a temporary file and renames it to filename, so readers never see a partial file
+
+    :returns the size of the file
+    """
+
+    _tmp = filename + '.tmp'
+    with open(_tmp, 'wb') as _f:
+        pickle.dump(data, _f, protocol=pickle.HIGHEST_PROTOCOL)
+        _f.flush()
+        os.fsync(_f.fileno())
+        _size = _f.tell()  # type: int
+
+    os.replace(_tmp, filename)
+    return _size
+
+
+def _read_local_db(filename: str) -> Tuple[Dict[str, Dict[str, Any]], int]:
+    """Reads the snapshot of a LocalDB and applies the deltas which are newer than it
+
+    :returns the data and the number of the last delta it contains
+    """
+
+    _data = {
+        'producers': {},
+        'products': {}
+    }  # type: Dict[str, Dict[str, Any]]
+
+    if os.path.exists(filename):
+        with open(filename, 'rb') as _f:
+            _data = pickle.load(_f)
+
+    # Deltas which were folded into the snapshot are left over if compact() was interrupted
+    _last_delta = _data.pop('last_delta', 0)  # type: int
+
+    for _number, _path in _delta_files(filename):
+        if _number <= _last_delta:
+            continue
+
+        try:
+            with open(_path, 'rb') as _f:
+                _delta = pickle.load(_f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            warnings.warn('Could not read {}, it and all later changes are ignored'.format(_path))
+            break
+
+        for _name in ('producers', 'products'):
+            _data[_name].update(_delta[_name])
+        _last_delta = _number
+
+    return _data, _last_delta
+
+
 class LocalDB(BaseDB):
+    """Local database which keeps everything in memory and persists it to a folder
+
+    On disk there is a snapshot, grafeo_local_db.p, and numbered delta files
+    next to it. Posts only mark records as dirty. flush() writes the dirty
+    records to a new delta file, so a flush costs O(records posted since the
+    last flush), not O(database). Once the deltas are as large as the
+    snapshot they are folded into a new snapshot. Every file is written to
+    a temporary name and renamed, a crash never leaves a partial file. A
+    delta which can not be read is renamed to .unreadable together with all
+    later ones, their changes are lost.
+
+    flush() is called at exit, every autoflush seconds in the background if
+    set, and by close().
+    Records are stored with their private keys, so the folder has to be kept secret.
+    """
+
+    def __init__(self, folderpath: str='/Users/lukas/', autoflush: float = None):
+        """Loads the snapshot and all deltas in the folder
+
+        :param folderpath: folder of the database files
+        :param autoflush: flush every that many seconds in a background thread, None for no background flushes
+        """
 
-    def __init__(self, folderpath: str='/Users/lukas/'):
         self._filename = os.path.abspath(os.path.join(
             folderpath,
             'grafeo_local_db.p'
         ))
-
-        if not os.path.exists(self._filename):
-            self._data = {
-                'producers': {},
-                'products': {}
-            }
-        else:
-            self._data = pickle.load(open(self._filename, "rb" ))
+        self._lock = threading.RLock()
+
+        with instrument.timer('localdb.load'):
+            self._data, _last_delta = _read_local_db(self._filename)
+
+        # Files written before records were frozen contain mutable objects
+        for _name in ('producers', 'products'):
+            for _pub_key, _prod in self._data[_name].items():
+                self._data[_name][_pub_key] = freeze(_prod)
+
+        self._dirty = {'producers': {}, 'products': {}}  # type: Dict[str, Dict[str, None]]
+        self._snapshot_size = os.path.getsize(self._filename) if os.path.exists(self._filename) else 0  # type: int
+        # Loading stopped at an unreadable delta. It and the later ones are moved aside,
+        # otherwise they would shadow the deltas of all future flushes
+        _deltas = []  # type: List[Tuple[int, str]]
+        for _number, _path in _delta_files(self._filename):
+            if _number > _last_delta:
+                os.replace(_path, _path + '.unreadable')
+            else:
+                _deltas.append((_number, _path))
+
+        self._next_delta = _last_delta + 1  # type: int
+        self._delta_size = sum(os.path.getsize(_path) for _number, _path in _deltas)  # type: int
+
+        self._build_index()
+
+        self._closed = threading.Event()
+        self._flusher = None  # type: threading.Thread
+        if autoflush is not None:
+            self._flusher = threading.Thread(target=self._autoflush, args=(autoflush,), daemon=True)
+            self._flusher.start()
 
         atexit.register(self._exit)
 
+    def _autoflush(self, interval: float):
+        while not self._closed.wait(interval):
+            self.flush()
+
+    def flush(self) -> bool:
+        """Writes all records posted since the last flush to a new delta file
+
+        :returns True if anything was written
+        """
+
+        with self._lock:
+            if not any(self._dirty.values()):
+                return False
+
+            with instrument.timer('localdb.flush'):
+                _delta = {
+                    _name: {_pub_key: self._data[_name][_pub_key] for _pub_key in _keys}
+                    for _name, _keys in self._dirty.items()
+                }
+
+                self._delta_size += _write_atomically(
+                    '{}.delta.{}'.format(self._filename, self._next_delta), _delta
+                )
+                self._next_delta += 1
+                self._dirty = {'producers': {}, 'products': {}}
+
+            if self._delta_size >= max(self._snapshot_size, 1 << 20):
+                self.compact()
+
+        return True
+
+    def compact(self):
+        """Writes a new snapshot of everything and removes the deltas"""
+
+        with self._lock, instrument.timer('localdb.save'):
+            _deltas = _delta_files(self._filename)
+
+            # The snapshot records the deltas it contains. If we crash before they are removed,
+            # loading skips them instead of applying older records on top of newer ones
+            self._snapshot_size = _write_atomically(
+                self._filename, dict(self._data, last_delta=self._next_delta - 1)
+            )
+            self._dirty = {'producers': {}, 'products': {}}
+
+            for _number, _path in _deltas:
+                os.remove(_path)
+            self._delta_size = 0
+
+    def close(self):
+        """Stops the background flushes and flushes a last time"""
+
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def _build_index(self):
+        """Builds the reverse index from inputs and producers to the products made of them
+
+        The index is not persisted, it is rebuilt whenever the data is loaded.
+        """
+
+        self._consumers = {}  # type: Dict[str, Dict[str, None]]
+        self._by_producer = {}  # type: Dict[str, Dict[str, None]]
+
+        for _product in self._data['products'].values():
+            self._index_product(_product)
+
+    def _index_product(self, product: Product):
+        for _input in product.input_pub_keys:
+            self._consumers.setdefault(_input, {})[product.pub_key] = None
+        self._by_producer.setdefault(product.producer_pub_key, {})[product.pub_key] = None
+
+    def _unindex_product(self, product: Product):
+        for _input in product.input_pub_keys:
+            self._consumers.get(_input, {}).pop(product.pub_key, None)
+        self._by_producer.get(product.producer_pub_key, {}).pop(product.pub_key, None)
+
     def _exit(self):
         print('local db is being destroyed ... ', end='')
-        pickle.dump(self._data, open(self._filename ,"wb"))
+        self.close()
         print('done')
 
     def _clean(self):
-        if os.path.exists(self._filename):
-            os.remove(self._filename)
+        with self._lock:
+            for _path in [self._filename] + [_path for _number, _path in _delta_files(self._filename)]:
+                if os.path.exists(_path):
+                    os.remove(_path)
 
-        self._data = {
-                'producers': {},
-                'products': {}
-            }
+            self._data = {
+                    'producers': {},
+                    'products': {}
+                }
+            self._dirty = {'producers': {}, 'products': {}}
+            self._snapshot_size = 0
+            self._delta_size = 0
+            self._build_index()
 
     def print(self):
         pprint.pprint(self._data)
 
     def get_producer(self, pub_key: str):
-        return copy.deepcopy(self._data['producers'].get(pub_key))
+        """Returns the stored FrozenProducer, use thaw() on it for a mutable copy"""
+        return self._data['producers'].get(pub_key)
 
     def get_product(self, pub_key: str):
-        return copy.deepcopy(self._data['products'].get(pub_key))
+        """Returns the stored FrozenProduct, use thaw() on it for a mutable copy"""
+        return self._data['products'].get(pub_key)
 
-    def post(self, prod: BaseProd) -> bool:
-        if not prod.is_valid():
+    @instrument.timed('LocalDB.post')
+    def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        if validate and not prod.is_valid():
             return False
 
-        if isinstance(prod, Producer):
-            self._data['producers'][prod.pub_key] = copy.deepcopy(prod)
-        elif isinstance(prod, Product):
-            self._data['products'][prod.pub_key] = copy.deepcopy(prod)
-        else:
+        try:
+            _frozen = freeze(prod)  # type: BaseProd
+        except (TypeError, ValueError):
             return False
 
+        with self._lock:
+            if isinstance(prod, Producer):
+                self._data['producers'][prod.pub_key] = _frozen
+                self._dirty['producers'][prod.pub_key] = None
+            else:
+                _old = self._data['products'].get(prod.pub_key)  # type: Product
+                if _old is not None:
+                    self._unindex_product(_old)
+
+                self._data['products'][prod.pub_key] = _frozen
+                self._dirty['products'][prod.pub_key] = None
+                self._index_product(_frozen)
+
         return True
 
+    def products_by_producer(self, pub_key: str) -> List[str]:
+        """Returns the public keys of all products made by the producer pub_key"""
+        return list(self._by_producer.get(pub_key, ()))
+
+    def downstream(self, pub_key: str, depth: int = None) -> List[str]:
+        """Returns all products which were (transitively) made from a product or by a producer
+
+        Runs in time proportional to the size of the result.
+
+        :param pub_key: public key of a product or producer
+        :param depth: only follow this many steps, the products directly made of/by pub_key are one step
+        :returns the public keys of the products in breadth-first order
+        """
+
+        _result = {}  # type: Dict[str, None]
+        _level = [pub_key]  # type: List[str]
+        _depth = 0  # type: int
+
+        while _level and (depth is None or _depth < depth):
+            _next = []  # type: List[str]
+
+            for _pub_key in _level:
+                for _index in (self._consumers, self._by_producer):
+                    for _product in _index.get(_pub_key, ()):
+                        if _product not in _result and _product != pub_key:
+                            _result[_product] = None
+                            _next.append(_product)
+
+            _level = _next
+            _depth += 1
+
+        return list(_result)
+
     def producers(self):
         return self._data['producers'].values()
 
     def products(self):
         return self._data['products'].values()
 
+
+
+from .chain import ChainNode, validate_chain
+from .aio import AsyncRemoteDB
+from .logdb import LogDB
+from .sqlitedb import SQLiteDB
+from .jsonl import TransferStats, read_jsonl, export_jsonl, import_jsonl
+from .cacheddb import CacheInfo, CachedDB
+from . import wire
+from .diskcache import DiskCache
+from .lazy import InvalidRecordError, LazyRecord
+from .snapshot import SnapshotDB, export_snapshot
+from .sharded import ShardedDB
@@ -0,0 +1,135 @@
+import os
+import asyncio
+import weakref
+import concurrent.futures
+
+from typing import List, Optional
+from . import RemoteDB, BaseProd, Producer, Product, new_product
+
+
+class AsyncRemoteDB(object):
+    """asyncio version of RemoteDB
+
+    Offers the methods of RemoteDB as coroutines. At most concurrency requests
+    per event loop are in flight at the same time, they share the pooled
+    keep-alive connections of one RemoteDB session. Signature checks and
+    signing run in an executor so that they never block the event loop.
+    One client may be used from several loops, e.g. by consecutive asyncio.run calls.
+    """
+
+    def __init__(self,
+                 url: str,
+                 concurrency: int = 10,
+                 timeout: float = 10.0,
+                 retries: int = 3,
+                 backoff_factor: float = 0.1,
+                 wire: str = 'json',
+                 cache_dir: Optional[str] = None,
+                 executor: Optional[concurrent.futures.Executor] = None):
+        """Connect to a remote database
+
+        :param url: base url of the server
+        :param concurrency: maximal number of concurrent requests (and pooled connections)
+        :param timeout: see RemoteDB
+        :param retries: see RemoteDB
+        :param backoff_factor: see RemoteDB
+        :param wire: see RemoteDB
+        :param cache_dir: see RemoteDB
+        :param executor: executor for validation and signing, defaults to a thread pool with one thread per cpu
+        """
+
+        self._db = RemoteDB(
+            url=url,
+            pool_size=concurrency,
+            timeout=timeout,
+            retries=retries,
+            backoff_factor=backoff_factor,
+            wire=wire,
+            cache_dir=cache_dir
+        )  # type: RemoteDB
+        self.url = self._db.url  # type: str
+
+        self._concurrency = concurrency  # type: int
+        self._semaphores = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+        self._io = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+        self._own_executor = executor is None  # type: bool
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        self._executor = executor  # type: concurrent.futures.Executor
+
+    def close(self):
+        """Closes all pooled connections and the owned executors"""
+
+        self._io.shutdown()
+        if self._own_executor:
+            self._executor.shutdown()
+        self._db.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def _request(self, func, *args):
+        """Runs a blocking request of the underlying RemoteDB, bounded by the semaphore"""
+
+        _loop = asyncio.get_running_loop()
+
+        # A semaphore is bound to the loop it is used in, so every loop gets its own
+        _semaphore = self._semaphores.get(_loop)  # type: Optional[asyncio.Semaphore]
+        if _semaphore is None:
+            _semaphore = self._semaphores[_loop] = asyncio.Semaphore(self._concurrency)
+
+        async with _semaphore:
+            return await _loop.run_in_executor(self._io, func, *args)
+
+    async def _is_valid(self, prod: BaseProd) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, prod.is_valid)
+
+    async def _get(self, cls, fetch, pub_key: str):
+        _loop = asyncio.get_running_loop()
+
+        _prod = await _loop.run_in_executor(self._io, self._db._from_cache, cls, pub_key)
+        if _prod is not None:
+            return _prod
+
+        _prod = await self._request(fetch, pub_key)
+        if _prod is None or not await self._is_valid(_prod):
+            return None
+
+        await _loop.run_in_executor(self._io, self._db._to_cache, [_prod])
+        return _prod
+
+    async def get_producer(self, pub_key: str):
+        return await self._get(Producer, self._db._get_producer, pub_key)
+
+    async def get_product(self, pub_key: str):
+        return await self._get(Product, self._db._get_product, pub_key)
+
+    async def gather_products(self, pub_keys: List[str]) -> List[Optional[Product]]:
+        """Fetches many products concurrently
+
+        :returns the products in the order of pub_keys, None for missing or invalid ones
+        """
+
+        return await asyncio.gather(*[self.get_product(_pub_key) for _pub_key in pub_keys])
+
+    async def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        if validate and not await self._is_valid(prod):
+            return False
+
+        return await self._request(self._db._post, prod)
+
+    async def post_producer(self, name: str) -> bool:
+        _producer = await asyncio.get_running_loop().run_in_executor(
+            self._executor, lambda: Producer(name=name)
+        )  # type: Producer
+        return await self.post(_producer)
+
+    async def post_product(self, name: str, producer: Producer, inputs: List[Product]) -> bool:
+        _product = await asyncio.get_running_loop().run_in_executor(
+            self._executor, lambda: new_product(name=name, producer=producer, inputs=inputs)
+        )  # type: Product
+        return await self.post(_product)
@@ -0,0 +1,221 @@
+import time
+import threading
+import collections
+
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+from . import BaseDB, BaseProd, Producer, Product, freeze
+
+
+"""Statistics of a CachedDB, in the spirit of functools.lru_cache"""
+CacheInfo = NamedTuple('CacheInfo', [
+    ('hits', int),
+    ('negative_hits', int),
+    ('misses', int),
+    ('maxsize', int),
+    ('currsize', int)
+])
+
+
+class _Cache(object):
+    """Size bounded LRU of pub_key -> (expiry time, frozen produc(er/t) or None for a known miss)"""
+
+    def __init__(self, maxsize: int, clock: Callable[[], float]):
+        self.maxsize = maxsize  # type: int
+        self._clock = clock
+        self._entries = collections.OrderedDict()  # type: collections.OrderedDict
+
+    def get(self, pub_key: str) -> Optional[Tuple[Optional[BaseProd]]]:
+        """Returns a 1-tuple with the cached value or None if nothing (unexpired) is cached"""
+
+        _entry = self._entries.get(pub_key)
+        if _entry is None:
+            return None
+
+        if _entry[0] is not None and _entry[0] <= self._clock():
+            del self._entries[pub_key]
+            return None
+
+        self._entries.move_to_end(pub_key)
+        return _entry[1],
+
+    def put(self, pub_key: str, value: Optional[BaseProd], ttl: Optional[float]):
+        if ttl is not None and ttl <= 0:
+            self._entries.pop(pub_key, None)
+            return
+
+        self._entries[pub_key] = (None if ttl is None else self._clock() + ttl, value)
+        self._entries.move_to_end(pub_key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, pub_key: str):
+        self._entries.pop(pub_key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachedDB(BaseDB):
+    """Read-through cache in front of any other database
+
+    Produc(er/t)s are signed and addressed by their public key, so a record
+    which was once found valid stays valid. Records returned by the wrapped
+    database are frozen and kept in a size bounded LRU per kind, optionally
+    only for ttl seconds. Lookups which found nothing are remembered for
+    negative_ttl seconds, so that asking again and again for a missing record
+    does not hit the wrapped database every time.
+
+    Only what the wrapped database returns from get_* or accepted from a
+    validated post is cached. RemoteDB and LocalDB validate before they return
+    something, for other backends pass validate=True.
+    Attributes which CachedDB does not have are looked up on the wrapped database.
+    """
+
+    def __init__(self,
+                 db: BaseDB,
+                 maxsize: int = 4096,
+                 ttl: Optional[float] = None,
+                 negative_ttl: Optional[float] = 10.0,
+                 validate: bool = False,
+                 clock: Callable[[], float] = time.monotonic):
+        """Wraps a database
+
+        :param db: the wrapped database
+        :param maxsize: maximal number of cached producers and, separately, of cached products
+        :param ttl: seconds after which a cached record is fetched again, None for never
+        :param negative_ttl: seconds for which a missing record is remembered, 0 to not remember misses
+        :param validate: validate records returned by db before caching them
+        :param clock: returns the current time in seconds
+        """
+
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+
+        self.db = db  # type: BaseDB
+        self.ttl = ttl  # type: Optional[float]
+        self.negative_ttl = negative_ttl  # type: Optional[float]
+        self.validate = validate  # type: bool
+
+        self._lock = threading.Lock()
+        self._caches = {
+            Producer: _Cache(maxsize, clock),
+            Product: _Cache(maxsize, clock)
+        }
+
+        self.hits = 0  # type: int
+        self.negative_hits = 0  # type: int
+        self.misses = 0  # type: int
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes CachedDB does not have itself
+        if name == 'db':
+            raise AttributeError(name)
+        return getattr(self.db, name)
+
+    def close(self):
+        if hasattr(self.db, 'close'):
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self, cls, fetch: Callable[[str], Any], pub_key: str):
+        _cache = self._caches[cls]  # type: _Cache
+
+        with self._lock:
+            _cached = _cache.get(pub_key)
+            if _cached is not None:
+                if _cached[0] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return _cached[0]
+
+            self.misses += 1
+
+        # The lock is not held while the wrapped database is asked, that can take a network round trip
+        _prod = fetch(pub_key)
+
+        # A record under another key is as bad as an invalid one, it would be cached under the wrong key
+        if _prod is not None:
+            if not isinstance(_prod, cls) or _prod.pub_key != pub_key or (self.validate and not _prod.is_valid()):
+                _prod = None
+            else:
+                _prod = freeze(_prod)
+
+        with self._lock:
+            _cache.put(pub_key, _prod, self.ttl if _prod is not None else self.negative_ttl)
+
+        return _prod
+
+    def get_producer(self, pub_key: str):
+        return self._get(Producer, self.db.get_producer, pub_key)
+
+    def get_product(self, pub_key: str):
+        return self._get(Product, self.db.get_product, pub_key)
+
+    def _stored(self, prod: BaseProd, accepted: bool, validate: bool):
+        """Updates the cache after a post"""
+
+        for _cls, _cache in self._caches.items():
+            if isinstance(prod, _cls):
+                with self._lock:
+                    if accepted and validate:
+                        _cache.put(prod.pub_key, freeze(prod), self.ttl)
+                    else:
+                        _cache.pop(prod.pub_key)
+
+    def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        _accepted = self.db.post(prod, validate=validate)  # type: bool
+        self._stored(prod, _accepted, validate)
+        return _accepted
+
+    def post_many(self, prods: List[BaseProd], validate: bool = True) -> List[bool]:
+        _results = self.db.post_many(prods, validate=validate)  # type: List[bool]
+        for _prod, _accepted in zip(prods, _results):
+            self._stored(_prod, _accepted, validate)
+        return _results
+
+    def invalidate(self, pub_key: str):
+        """Forgets everything cached about pub_key"""
+
+        with self._lock:
+            for _cache in self._caches.values():
+                _cache.pop(pub_key)
+
+    def clear(self):
+        """Empties the cache and resets the statistics"""
+
+        with self._lock:
+            for _cache in self._caches.values():
+                _cache.clear()
+            self.hits = 0
+            self.negative_hits = 0
+            self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups which were answered from the cache"""
+
+        with self._lock:
+            _lookups = self.hits + self.negative_hits + self.misses  # type: int
+            return (self.hits + self.negative_hits) / _lookups if _lookups else 0.0
+
+    def info(self) -> CacheInfo:
+        """Returns hits, negative hits, misses, maxsize and current size of the cache"""
+
+        with self._lock:
+            return CacheInfo(
+                self.hits,
+                self.negative_hits,
+                self.misses,
+                self._caches[Producer].maxsize,
+                sum(len(_cache) for _cache in self._caches.values())
+            )
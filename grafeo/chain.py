@@ -0,0 +1,127 @@
+import os
+import collections
+import concurrent.futures
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from . import BaseDB, BaseProd, Producer, Product, RemoteDB, validate_many
+
+
+"""Result of the validation of one node of a supply chain
+
+kind is either 'product' or 'producer', depth the (shortest) distance from the root,
+found is False if the database did not return the node,
+valid is True if the node was found and all its signatures are correct
+"""
+ChainNode = NamedTuple('ChainNode', [
+    ('pub_key', str),
+    ('kind', str),
+    ('depth', int),
+    ('found', bool),
+    ('valid', bool)
+])
+
+
+def _validate_chunk(prods: List[BaseProd]) -> List[bool]:
+    """Validates a list of produc(er/t)s, runs inside the worker processes"""
+
+    return validate_many(prods)
+
+
+def _fetch(db: BaseDB, cls, pub_key: str) -> Optional[BaseProd]:
+    """Gets a produc(er/t) without letting a RemoteDB check it, the pool does that"""
+
+    if isinstance(db, RemoteDB):
+        _prod = db._from_cache(cls, pub_key)
+        if _prod is not None:
+            return _prod
+        return db._get_product(pub_key) if cls is Product else db._get_producer(pub_key)
+
+    return db.get_product(pub_key=pub_key) if cls is Product else db.get_producer(pub_key=pub_key)
+
+
+def validate_chain(root_pub_key: str,
+                   db: BaseDB,
+                   workers: Optional[int] = None,
+                   chunksize: int = 16) -> Dict[str, ChainNode]:
+    """Validates a product and everything it was made of
+
+    The graph spanned by input_pub_keys and producer_pub_key is walked
+    breadth-first starting at the root product. Every product and producer is
+    fetched and checked exactly once, even if it is used by several products.
+    While the walk continues, the fetched nodes are validated in chunks by a
+    pool of worker processes. A RemoteDB is read without its own signature
+    checks, so that they run only once and in parallel.
+
+    :param root_pub_key: public key of the final product
+    :param db: database the chain is stored in
+    :param workers: number of worker processes, defaults to the number of cpus. With 1 no pool is used
+    :param chunksize: number of nodes handed to a worker at once
+    :returns a report with one ChainNode per visited public key in breadth-first order
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    _report = collections.OrderedDict()  # type: Dict[str, ChainNode]
+    _queue = collections.deque([(root_pub_key, 'product', 0)])
+    _seen = {root_pub_key}
+
+    _pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    _futures = []  # type: List[Tuple[List[ChainNode], concurrent.futures.Future]]
+    _pending = []  # type: List[ChainNode]
+    _pending_prods = []  # type: List[BaseProd]
+
+    def _flush():
+        if not _pending:
+            return
+
+        if _pool is None:
+            _finish(list(_pending), _validate_chunk(_pending_prods))
+        else:
+            _futures.append((list(_pending), _pool.submit(_validate_chunk, list(_pending_prods))))
+
+        del _pending[:]
+        del _pending_prods[:]
+
+    def _finish(nodes: List[ChainNode], results: List[bool]):
+        for _node, _valid in zip(nodes, results):
+            _report[_node.pub_key] = _node._replace(valid=_valid)
+
+    try:
+        while _queue:
+            _pub_key, _kind, _depth = _queue.popleft()
+
+            _prod = _fetch(db, Product if _kind == 'product' else Producer, _pub_key)
+
+            _node = ChainNode(_pub_key, _kind, _depth, _prod is not None, False)
+            _report[_pub_key] = _node
+
+            if _prod is None:
+                continue
+
+            _pending.append(_node)
+            _pending_prods.append(_prod)
+            if len(_pending) >= chunksize:
+                _flush()
+
+            if _kind != 'product':
+                continue
+
+            _next = [(_prod.producer_pub_key, 'producer')]
+            _next.extend((_input, 'product') for _input in _prod.input_pub_keys or [])
+
+            for _next_pub_key, _next_kind in _next:
+                if _next_pub_key not in _seen:
+                    _seen.add(_next_pub_key)
+                    _queue.append((_next_pub_key, _next_kind, _depth + 1))
+
+        _flush()
+
+        for _nodes, _future in _futures:
+            _finish(_nodes, _future.result())
+
+    finally:
+        if _pool is not None:
+            _pool.shutdown()
+
+    return _report
@@ -1,9 +1,84 @@
 import nacl.signing
 import nacl.encoding
 import nacl.exceptions
-
-from typing import Dict
+import nacl.bindings
+import nacl.utils
+
+import os
+import hashlib
+import functools
+import threading
+import collections
+import concurrent.futures
+import re
+from typing import Dict, Iterable, List, Tuple, NamedTuple, Optional, Union
 from .common import separators
+from . import instrument
+
+
+_HEX_STRING = re.compile('[0-9a-f]*')
+
+
+"""Statistics of the verified-signature cache, in the spirit of functools.lru_cache"""
+SignatureCacheInfo = NamedTuple('SignatureCacheInfo', [
+    ('hits', int),
+    ('misses', int),
+    ('maxsize', int),
+    ('currsize', int)
+])
+
+
+class _SignatureCache(object):
+    """Size bounded LRU set of successfully verified (pub_key, message digest, signature) triples
+
+    Only successful verifications are remembered. A hit means that libsodium
+    already accepted exactly this signature for exactly this message.
+    """
+
+    def __init__(self):
+        self.maxsize = 0  # type: int
+        self.hits = 0  # type: int
+        self.misses = 0  # type: int
+        self._entries = collections.OrderedDict()  # type: collections.OrderedDict
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Tuple[str, bytes, str]) -> bool:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            return False
+
+    def add(self, key: Tuple[str, bytes, str]):
+        with self._lock:
+            self._entries[key] = None
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def resize(self, maxsize: int):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> SignatureCacheInfo:
+        with self._lock:
+            return SignatureCacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+
+_signature_cache = _SignatureCache()  # type: _SignatureCache
 
 
 def _check_string(s: str) -> bool:
@@ -16,6 +91,22 @@ def _check_string(s: str) -> bool:
     return isinstance(s, str)
 
 
+def _encode_message(message: Union[str, bytes]) -> Optional[bytes]:
+    """Returns the utf-8 encoding of a message, already encoded messages are returned as they are
+
+    :param message: string or bytes
+    :returns the bytes or None if message is neither
+    """
+
+    if isinstance(message, bytes):
+        return message
+
+    if _check_string(message):
+        return message.encode('utf-8')
+
+    return None
+
+
 def _check_hex_string(s: str) -> bool:
     """Checks if s is a valid hex-string
 
@@ -26,12 +117,39 @@ def _check_hex_string(s: str) -> bool:
     if not _check_string(s):
         return False
 
-    if any((_letter not in set('0123456789abcdef')) for _letter in s):
+    if _HEX_STRING.fullmatch(s) is None:
         return False
 
     return True
 
 
+def _find_invalid_hex_string(strings: Iterable[str], length: int) -> int:
+    """Finds the first entry which is not a hex-string of the given length
+
+    The character set of all entries is checked in one pass over their concatenation,
+    only if that fails the entries are checked one by one.
+
+    :param strings: strings to check
+    :param length: required length of every string
+    :returns the index of the first malformed entry or -1 if all are fine
+    """
+
+    strings = list(strings)
+
+    # Only the entries before the first one of wrong type or length need the character check
+    _end = next(
+        (_index for _index, _s in enumerate(strings) if not _check_string(_s) or len(_s) != length),
+        len(strings)
+    )  # type: int
+
+    if _HEX_STRING.fullmatch(''.join(strings[:_end])) is None:
+        for _index, _s in enumerate(strings[:_end]):
+            if _HEX_STRING.fullmatch(_s) is None:
+                return _index
+
+    return _end if _end < len(strings) else -1
+
+
 def check_utf8_string(s: str) -> bool:
     """Check if a utf-8 string contains no separators
 
@@ -72,6 +190,16 @@ def check_pub_key(pub_key: str) -> bool:
     return True
 
 
+def find_invalid_pub_key(pub_keys: Iterable[str]) -> int:
+    """Checks many public keys at once
+
+    :param pub_keys: strings to check
+    :returns the index of the first entry which is no valid public key or -1 if all are valid
+    """
+
+    return _find_invalid_hex_string(pub_keys, 64)
+
+
 def check_priv_key(priv_key: str) -> bool:
     """Checks validity of private key
 
@@ -107,6 +235,140 @@ def generate_key_pair() -> Dict[str, str]:
     }
 
 
+@instrument.timed('crypto.generate_key_pairs')
+def generate_key_pairs(n: int) -> Tuple[bytes, bytes]:
+    """Generates many public-private key pairs at once
+
+    The seeds are drawn from libsodium in one call and no SigningKey objects
+    are built. Key pair i is pub_keys[32 * i:32 * (i + 1)], priv_keys[32 * i:32 * (i + 1)],
+    bytes.hex() of a slice gives the usual hex-string.
+
+    :param n: number of key pairs
+    :returns the packed raw public keys and the packed raw private keys, 32 bytes per key
+    """
+
+    _priv_keys = nacl.utils.random(32 * n) if n > 0 else b''  # type: bytes
+    _pub_keys = b''.join(
+        nacl.bindings.crypto_sign_seed_keypair(_priv_keys[_i:_i + 32])[0] for _i in range(0, 32 * n, 32)
+    )  # type: bytes
+
+    return _pub_keys, _priv_keys
+
+
+class _KeyPool(object):
+    """Key pairs generated ahead of time by a background thread
+
+    The pool is refilled in batches once it holds less than half of its size.
+    When it runs dry a key pair is generated on the spot. Every key pair is
+    handed out only once, after a fork the child starts with an empty pool.
+    """
+
+    def __init__(self, size: int, batch_size: int):
+        self.size = size  # type: int
+        self.batch_size = batch_size  # type: int
+        self._pairs = collections.deque()  # type: collections.deque
+        self._wanted = threading.Event()
+        self._closed = False  # type: bool
+
+        self._wanted.set()
+        self._thread = threading.Thread(target=self._refill, name='grafeo-key-pool', daemon=True)
+        self._thread.start()
+
+    def _refill(self):
+        while True:
+            self._wanted.wait()
+            if self._closed:
+                return
+
+            if len(self._pairs) >= self.size:
+                self._wanted.clear()
+                continue
+
+            _pub_keys, _priv_keys = generate_key_pairs(min(self.batch_size, self.size - len(self._pairs)))
+            _pub_keys, _priv_keys = _pub_keys.hex(), _priv_keys.hex()
+            self._pairs.extend(
+                (_pub_keys[_i:_i + 64], _priv_keys[_i:_i + 64]) for _i in range(0, len(_pub_keys), 64)
+            )
+
+    def get(self) -> Dict[str, str]:
+        try:
+            _pub_key, _priv_key = self._pairs.popleft()
+        except IndexError:
+            instrument.count('crypto.key_pool_misses')
+            self._wanted.set()
+            return generate_key_pair()
+
+        if len(self._pairs) < self.size // 2:
+            self._wanted.set()
+
+        return {
+            "pub_key": _pub_key,
+            "priv_key": _priv_key
+        }
+
+    def close(self):
+        self._closed = True
+        self._pairs.clear()
+        self._wanted.set()
+
+
+_key_pool = None  # type: Optional[_KeyPool]
+
+
+def enable_key_pool(size: int = 1024, batch_size: int = 256):
+    """Generate key pairs for new produc(er/t)s ahead of time in a background thread
+
+    Afterwards produc(er/t)s created without a public key take their key
+    pair from the pool, so bursts of object creation do not wait for key
+    generation.
+
+    :param size: number of key pairs kept ready
+    :param batch_size: number of key pairs generated at once by the background thread
+    """
+
+    global _key_pool
+
+    if size <= 0 or batch_size <= 0:
+        raise ValueError('size and batch_size have to be positive, use disable_key_pool to switch the pool off')
+
+    disable_key_pool()
+    _key_pool = _KeyPool(size, batch_size)
+
+
+def disable_key_pool():
+    """Stop the key pool and drop all unused key pairs (the default)"""
+
+    global _key_pool
+
+    if _key_pool is not None:
+        _key_pool.close()
+        _key_pool = None
+
+
+def _forget_key_pool():
+    """The pool thread does not survive a fork and the parent may still hand out the same keys"""
+
+    global _key_pool
+
+    if _key_pool is not None:
+        _key_pool._pairs.clear()
+        _key_pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_key_pool)
+
+
+def pooled_key_pair() -> Dict[str, str]:
+    """Returns a key pair from the key pool if it is enabled, a freshly generated one otherwise"""
+
+    _pool = _key_pool
+    if _pool is None:
+        return generate_key_pair()
+
+    return _pool.get()
+
+
 def check_signature(signature: str) -> bool:
     """Check if the signature is valid
 
@@ -124,6 +386,16 @@ def check_signature(signature: str) -> bool:
     return True
 
 
+def find_invalid_signature(signatures: Iterable[str]) -> int:
+    """Checks many signatures at once
+
+    :param signatures: strings to check
+    :returns the index of the first entry which is no technically correct signature or -1 if all are fine
+    """
+
+    return _find_invalid_hex_string(signatures, 128)
+
+
 def validate_signed_message(
         pub_key: str,
         message: str,
@@ -133,7 +405,7 @@ def validate_signed_message(
     This method checks the types of all three inputs for their type
 
     :param pub_key: The public key to check the signature against (hex-string)
-    :param message: The message for which the signature was alegedly constructed (a string)
+    :param message: The message for which the signature was alegedly constructed (a string or its utf-8 encoding)
     :param signature: The alleged signature of the message with the private key (hex-string)
     :returns True if the triple is correct
     """
@@ -141,41 +413,240 @@ def validate_signed_message(
     # Check Types
     if not check_pub_key(pub_key):
         return False
-    if not _check_string(message):
+    message_bytes = _encode_message(message)  # type: Optional[bytes]
+    if message_bytes is None:
         return False
     if not check_signature(signature):
         return False
 
+    return _verify(pub_key, message_bytes, signature)
+
+
+def _verify(pub_key: str, message_bytes: bytes, signature: str, digest: Optional[bytes] = None) -> bool:
+    """Verifies an already format checked triple, consulting the signature cache if enabled
+
+    :param pub_key: public key (hex-string)
+    :param message_bytes: the utf-8 encoded message
+    :param signature: signature (hex-string)
+    :param digest: sha256 digest of message_bytes, computed if not given
+    :returns True if the triple is correct
+    """
+
+    _key = None  # type: Optional[Tuple[str, bytes, str]]
+
+    if _signature_cache.maxsize > 0:
+        if digest is None:
+            digest = hashlib.sha256(message_bytes).digest()
+        _key = (pub_key, digest, signature)
+
+        if _key in _signature_cache:
+            instrument.count('crypto.signature_cache_hits')
+            return True
+
     # Convert to bytes
-    message_bytes = message.encode('utf-8')  # type: bytes
-    pk_bytes = nacl.encoding.HexEncoder.decode(pub_key)  # type: bytes
-    signature_bytes = nacl.encoding.HexEncoder.decode(signature)  # type: bytes
+    with instrument.timer('crypto.hex_decode'):
+        pk_bytes = nacl.encoding.HexEncoder.decode(pub_key)  # type: bytes
+        signature_bytes = nacl.encoding.HexEncoder.decode(signature)  # type: bytes
 
     # Check with lib sodium
-    verify_key = nacl.signing.VerifyKey(pk_bytes)  # type: nacl.signing.VerifyKey
-
     try:
-        verify_key.verify(smessage=message_bytes, signature=signature_bytes)
-        return True
+        with instrument.timer('crypto.verify'):
+            nacl.bindings.crypto_sign_open(signature_bytes + message_bytes, pk_bytes)
     except nacl.exceptions.BadSignatureError:
         return False
 
+    if _key is not None:
+        _signature_cache.add(_key)
+
+    return True
+
+
+def enable_signature_cache(maxsize: int = 4096):
+    """Remember successful signature verifications
+
+    Once enabled, validating the same (pub_key, message, signature) again does
+    not touch libsodium. Failed verifications are never cached.
+
+    :param maxsize: maximal number of remembered verifications, least recently used ones are evicted
+    """
+
+    if maxsize <= 0:
+        raise ValueError('maxsize has to be positive, use disable_signature_cache to switch the cache off')
+
+    _signature_cache.resize(maxsize)
+
+
+def disable_signature_cache():
+    """Switch off and empty the signature cache (the default)"""
+
+    _signature_cache.resize(0)
+    _signature_cache.clear()
+
+
+def clear_signature_cache():
+    """Forget all cached verifications and reset the hit and miss counters"""
+
+    _signature_cache.clear()
+
+
+def signature_cache_info() -> SignatureCacheInfo:
+    """Returns hits, misses, maxsize and current size of the signature cache"""
+
+    return _signature_cache.info()
+
+
+def find_invalid_signed_message(triples: Iterable[Tuple[str, Union[str, bytes], str]]) -> int:
+    """Checks many triples key, data, signature in one go
+
+    All triples are checked for their format first, so a malformed entry is
+    found before any signature is verified. Each distinct message is only
+    encoded once and no VerifyKey objects are constructed, which pays off for
+    products with many inputs that all sign the same payload.
+
+    libsodium offers no batch verification for ed25519, thus the signatures
+    are still verified one by one and the first failure is reported.
+
+    :param triples: iterable of (pub_key, message, signature) as in validate_signed_message
+    :returns the index of the first invalid triple or -1 if all triples are valid
+    """
+
+    triples = list(triples)
+
+    # Check Types
+    with instrument.timer('crypto.check_format'):
+        _invalid = [
+            find_invalid_pub_key([_triple[0] for _triple in triples]),
+            find_invalid_signature([_triple[2] for _triple in triples]),
+            next((_index for _index, _triple in enumerate(triples) if not isinstance(_triple[1], (str, bytes))), -1)
+        ]  # type: List[int]
+    _invalid = [_index for _index in _invalid if _index >= 0]
+
+    if _invalid:
+        return min(_invalid)
+
+    # Check with lib sodium
+    _encoded = {}  # type: Dict[Union[str, bytes], Tuple[bytes, Optional[bytes]]]
 
-def sign_message(priv_key: str, message: str) -> str:
+    for _index, (_pub_key, _message, _signature) in enumerate(triples):
+        if _message not in _encoded:
+            message_bytes = _encode_message(_message)  # type: bytes
+            _encoded[_message] = (
+                message_bytes,
+                hashlib.sha256(message_bytes).digest() if _signature_cache.maxsize > 0 else None
+            )
+
+        message_bytes, digest = _encoded[_message]
+
+        if not _verify(_pub_key, message_bytes, _signature, digest=digest):
+            return _index
+
+    return -1
+
+
+def validate_signed_messages(triples: Iterable[Tuple[str, Union[str, bytes], str]]) -> bool:
+    """Checks if all triples key, data, signature are valid
+
+    :param triples: iterable of (pub_key, message, signature) as in validate_signed_message
+    :returns True if all triples are correct
+    """
+
+    return find_invalid_signed_message(triples) == -1
+
+
+@instrument.timed('crypto.sign')
+def sign_message(priv_key: str, message: Union[str, bytes]) -> str:
     """Sign the message message with the key
 
     :param priv_key: the private key
-    :param message: the message to be signed
+    :param message: the message to be signed, a string or its utf-8 encoding
     :returns the signature of the message
     """
 
     # Change to bytes
-    _message_bytes = message.encode('utf8')  # type: bytes
+    _message_bytes = _encode_message(message)  # type: bytes
+
+    return _sign(_signing_key(priv_key), _message_bytes)
+
+
+def _sign(signing_key: nacl.signing.SigningKey, message_bytes: bytes) -> str:
+    _signed = signing_key.sign(message_bytes)  # type: nacl.signing.SignedMessage
+
+    return nacl.encoding.HexEncoder.encode(_signed._signature).decode('ascii')
+
+
+@functools.lru_cache(maxsize=1024)
+def _signing_key(priv_key: str) -> nacl.signing.SigningKey:
+    """Returns the SigningKey of a private key, recently used ones are reused"""
+
     _priv_key_bytes = nacl.encoding.HexEncoder.decode(priv_key)  # types: bytes
-    _signing_key = nacl.signing.SigningKey(seed=_priv_key_bytes)  # types: nacl.signing.SigningKey
+    return nacl.signing.SigningKey(seed=_priv_key_bytes)
+
+
+def clear_signing_keys():
+    """Forget the recently used signing keys, which hold the private keys in memory"""
+
+    _signing_key.cache_clear()
+
+
+def derive_pub_key(priv_key: str) -> str:
+    """Returns the public key which belongs to a private key
+
+    :param priv_key: the private key
+    :returns the public key as hex-string
+    """
+
+    return nacl.encoding.HexEncoder.encode(_signing_key(priv_key).verify_key._key).decode('ascii')
+
+
+"""Signing is spread over threads from this many keys on, below the thread overhead dominates"""
+_PARALLEL_SIGNING_MIN_KEYS = 32
+
+_signing_pool = None  # type: Optional[concurrent.futures.ThreadPoolExecutor]
+_signing_pool_lock = threading.Lock()
+
+
+def _get_signing_pool() -> concurrent.futures.ThreadPoolExecutor:
+    global _signing_pool
+
+    with _signing_pool_lock:
+        if _signing_pool is None:
+            _signing_pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+    return _signing_pool
+
+
+@instrument.timed('crypto.sign_many')
+def sign_messages(priv_keys: List[str], message: Union[str, bytes], workers: Optional[int] = None) -> List[str]:
+    """Signs one message with many keys
+
+    The message is encoded once. For many keys the work is split into
+    workers chunks which are signed on a shared thread pool, libsodium
+    releases the GIL while signing. The pool has one thread per cpu, so at
+    most min(workers, cpus) chunks are signed at the same time.
+
+    :param priv_keys: the private keys
+    :param message: the message to be signed, a string or its utf-8 encoding
+    :param workers: number of chunks signed in parallel, defaults to the number of cpus
+    :returns the signatures in the order of priv_keys
+    """
+
+    instrument.count('crypto.signatures', len(priv_keys))
+
+    _message_bytes = _encode_message(message)  # type: bytes
+    _keys = [_signing_key(_priv_key) for _priv_key in priv_keys]  # type: List[nacl.signing.SigningKey]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1 or len(_keys) < _PARALLEL_SIGNING_MIN_KEYS:
+        return [_sign(_key, _message_bytes) for _key in _keys]
 
-    _signed = _signing_key.sign(_message_bytes)  # type: nacl.signing.SignedMessage
+    _chunk_size = -(-len(_keys) // workers)  # type: int
+    _chunks = [_keys[_i:_i + _chunk_size] for _i in range(0, len(_keys), _chunk_size)]
 
-    signature = nacl.encoding.HexEncoder.encode(_signed._signature).decode('ascii')  # types: str
+    _signatures = []  # type: List[str]
+    for _chunk_signatures in _get_signing_pool().map(
+            lambda _chunk: [_sign(_key, _message_bytes) for _key in _chunk], _chunks):
+        _signatures.extend(_chunk_signatures)
 
-    return signature
+    return _signatures
@@ -0,0 +1,135 @@
+import os
+import time
+import sqlite3
+import threading
+
+from typing import List, Optional
+from . import BaseProd, Producer, Product, wire
+
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS records (
+        kind INTEGER NOT NULL,
+        pub_key BLOB NOT NULL,
+        record BLOB NOT NULL,
+        used REAL NOT NULL,
+        PRIMARY KEY (kind, pub_key)
+    ) WITHOUT ROWID""",
+    """CREATE INDEX IF NOT EXISTS records_used ON records (used)""",
+]
+
+_SELECT = """SELECT record FROM records WHERE kind = ? AND pub_key = ?"""
+_TOUCH = """UPDATE records SET used = ? WHERE kind = ? AND pub_key = ?"""
+_INSERT = """INSERT OR REPLACE INTO records (kind, pub_key, record, used) VALUES (?, ?, ?, ?)"""
+_SIZE = """SELECT COALESCE(SUM(LENGTH(record)), 0) FROM records"""
+_OLDEST = """SELECT kind, pub_key, LENGTH(record) FROM records ORDER BY used LIMIT ?"""
+_DELETE = """DELETE FROM records WHERE kind = ? AND pub_key = ?"""
+
+_KINDS = [Producer, Product]
+
+
+def _kind(prod: BaseProd) -> int:
+    for _i, _cls in enumerate(_KINDS):
+        if isinstance(prod, _cls):
+            return _i
+    raise ValueError('Only producers and products can be cached')
+
+
+class DiskCache(object):
+    """Persistent cache of verified produc(er/t)s in a SQLite file
+
+    Records are stored in the binary format of grafeo.wire, without private
+    keys. Whatever is read from the cache is trusted without checking its
+    signatures again, so only records which were verified before may be put
+    and the cache directory must not be writable by anyone else.
+    Once the records take more than max_bytes, the least recently used ones
+    are deleted. Several processes may share one cache directory.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 64 << 20):
+        """Opens or creates the cache
+
+        :param cache_dir: folder of the cache file, created if missing
+        :param max_bytes: the size of all records is kept below this
+        """
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.max_bytes = max_bytes  # type: int
+        self._path = os.path.join(os.path.abspath(cache_dir), 'grafeo_cache.sqlite')  # type: str
+        self._lock = threading.RLock()
+
+        self._connection = sqlite3.connect(self._path, timeout=30.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self._connection:
+            for _statement in _SCHEMA:
+                self._connection.execute(_statement)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, cls, pub_key: str) -> Optional[BaseProd]:
+        """Returns the cached producer or product or None"""
+
+        try:
+            _key = (_KINDS.index(cls), bytes.fromhex(pub_key))
+        except (ValueError, TypeError):
+            return None
+
+        with self._lock:
+            _row = self._connection.execute(_SELECT, _key).fetchone()
+            if _row is None:
+                return None
+
+            with self._connection:
+                self._connection.execute(_TOUCH, (time.time(),) + _key)
+
+        try:
+            return wire.decode(_row[0])
+        except ValueError:
+            return None
+
+    def put_many(self, prods: List[BaseProd]):
+        """Stores verified produc(er/t)s, then evicts the least recently used records if the cache is too large"""
+
+        _rows = []
+        _now = time.time()  # type: float
+
+        for _prod in prods:
+            try:
+                _rows.append((_kind(_prod), bytes.fromhex(_prod.pub_key), wire.encode(_prod), _now))
+            except ValueError:
+                continue
+
+        if not _rows:
+            return
+
+        with self._lock, self._connection:
+            self._connection.executemany(_INSERT, _rows)
+            self._evict()
+
+    def put(self, prod: BaseProd):
+        self.put_many([prod])
+
+    def _evict(self):
+        _excess = self._connection.execute(_SIZE).fetchone()[0] - self.max_bytes  # type: int
+
+        while _excess > 0:
+            _rows = self._connection.execute(_OLDEST, (64,)).fetchall()
+            if not _rows:
+                return
+
+            for _kind_id, _pub_key, _size in _rows:
+                self._connection.execute(_DELETE, (_kind_id, _pub_key))
+                _excess -= _size
+                if _excess <= 0:
+                    return
+
+    def size(self) -> int:
+        """Returns the number of bytes taken by all records"""
+
+        with self._lock:
+            return self._connection.execute(_SIZE).fetchone()[0]
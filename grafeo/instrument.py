@@ -0,0 +1,307 @@
+"""Timers and counters on the hot paths of grafeo
+
+Instrumentation is off by default. Then every timer costs one function call
+and one check of a module global, nothing is recorded. It is switched on by
+adding a sink or, for the current thread only, by a breakdown:
+
+    sink = HistogramSink()
+    add_sink(sink)
+    ...
+    print(sink.prometheus_text())
+
+    with breakdown() as _b:
+        product.is_valid()
+    print(_b.report())
+
+Timer names are dotted, e.g. crypto.verify, payload.build, remotedb.get.
+Timers nest: the time of crypto.verify is also part of Product.is_valid.
+"""
+
+import bisect
+import logging
+import functools
+import threading
+
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+
+
+"""Number of sinks plus number of running breakdowns, everything is skipped while this is 0"""
+_active = 0  # type: int
+
+_sinks = []  # type: List[Any]
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Sink(object):
+    """Receives all timings and counts while it is added"""
+
+    def timing(self, name: str, seconds: float):
+        pass
+
+    def count(self, name: str, value: int):
+        pass
+
+
+"""Upper bounds in seconds of the histogram buckets, from 1us to 10s"""
+DEFAULT_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3,
+    2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class HistogramSink(Sink):
+    """Keeps a histogram per timer and a total per counter in memory"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))  # type: Tuple[float, ...]
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # name -> [bucket counts..., count of larger values], number of timings, sum of seconds
+            self._histograms = {}  # type: Dict[str, Tuple[List[int], List[float]]]
+            self.counters = {}  # type: Dict[str, int]
+
+    def timing(self, name: str, seconds: float):
+        with self._lock:
+            _histogram = self._histograms.get(name)
+            if _histogram is None:
+                _histogram = self._histograms[name] = ([0] * (len(self.buckets) + 1), [0, 0.0])
+
+            _histogram[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            _histogram[1][0] += 1
+            _histogram[1][1] += seconds
+
+    def count(self, name: str, value: int):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Returns count, total seconds and mean seconds of every timer"""
+
+        with self._lock:
+            return {
+                _name: {
+                    'count': _totals[0],
+                    'seconds': _totals[1],
+                    'mean': _totals[1] / _totals[0]
+                }
+                for _name, (_counts, _totals) in sorted(self._histograms.items())
+            }
+
+    def prometheus_text(self, prefix: str = 'grafeo') -> str:
+        """Dumps all histograms and counters in the Prometheus text exposition format"""
+
+        _lines = []  # type: List[str]
+
+        with self._lock:
+            if self._histograms:
+                _lines.append('# TYPE {}_seconds histogram'.format(prefix))
+
+            for _name, (_counts, _totals) in sorted(self._histograms.items()):
+                _cumulative = 0  # type: int
+                for _bound, _count in zip(self.buckets + (float('inf'),), _counts):
+                    _cumulative += _count
+                    _lines.append('{}_seconds_bucket{{name="{}",le="{}"}} {}'.format(
+                        prefix, _name, '+Inf' if _bound == float('inf') else repr(_bound), _cumulative
+                    ))
+                _lines.append('{}_seconds_sum{{name="{}"}} {!r}'.format(prefix, _name, _totals[1]))
+                _lines.append('{}_seconds_count{{name="{}"}} {}'.format(prefix, _name, _totals[0]))
+
+            if self.counters:
+                _lines.append('# TYPE {}_total counter'.format(prefix))
+
+            for _name, _value in sorted(self.counters.items()):
+                _lines.append('{}_total{{name="{}"}} {}'.format(prefix, _name, _value))
+
+        return '\n'.join(_lines) + '\n'
+
+
+class LoggingSink(Sink):
+    """Logs every timing and count"""
+
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.DEBUG):
+        self.logger = logger or logging.getLogger('grafeo.instrument')  # type: logging.Logger
+        self.level = level  # type: int
+
+    def timing(self, name: str, seconds: float):
+        self.logger.log(self.level, '%s took %.1f us', name, seconds * 1e6)
+
+    def count(self, name: str, value: int):
+        self.logger.log(self.level, '%s += %d', name, value)
+
+
+class Breakdown(object):
+    """Where the time of the code in a breakdown() block went, see report()"""
+
+    def __init__(self):
+        self.timers = {}  # type: Dict[str, List[float]]
+        self.counters = {}  # type: Dict[str, int]
+        self.seconds = 0.0  # type: float
+
+    def _timing(self, name: str, seconds: float):
+        _timer = self.timers.get(name)
+        if _timer is None:
+            _timer = self.timers[name] = [0, 0.0]
+        _timer[0] += 1
+        _timer[1] += seconds
+
+    def _count(self, name: str, value: int):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> str:
+        """A table of all timers, the most expensive first, and all counters"""
+
+        _lines = ['{:<28} {:>8} {:>12} {:>7}'.format('timer', 'calls', 'us', '%')]
+        for _name, (_calls, _seconds) in sorted(self.timers.items(), key=lambda _item: -_item[1][1]):
+            _lines.append('{:<28} {:>8} {:>12.1f} {:>7.1f}'.format(
+                _name, _calls, _seconds * 1e6, 100 * _seconds / self.seconds if self.seconds > 0 else 0.0
+            ))
+        _lines.append('{:<28} {:>8} {:>12.1f}'.format('(total)', '', self.seconds * 1e6))
+
+        for _name, _value in sorted(self.counters.items()):
+            _lines.append('{:<28} {:>8}'.format(_name, _value))
+
+        return '\n'.join(_lines)
+
+
+def _breakdowns() -> List[Breakdown]:
+    try:
+        return _local.breakdowns
+    except AttributeError:
+        _local.breakdowns = []
+        return _local.breakdowns
+
+
+class _BreakdownContext(object):
+
+    def __enter__(self) -> Breakdown:
+        global _active
+
+        self._breakdown = Breakdown()
+        _breakdowns().append(self._breakdown)
+        with _lock:
+            _active += 1
+
+        self._start = perf_counter()
+        return self._breakdown
+
+    def __exit__(self, *exc_info):
+        global _active
+
+        self._breakdown.seconds = perf_counter() - self._start
+        _breakdowns().remove(self._breakdown)
+        with _lock:
+            _active -= 1
+
+
+def breakdown() -> _BreakdownContext:
+    """Records all timers and counters of the current thread inside the with block into a Breakdown
+
+    Breakdowns work without any sink. Work done on other threads, e.g. by the
+    signing pool, only shows up as the timer around it.
+    """
+
+    return _BreakdownContext()
+
+
+def add_sink(sink: Sink):
+    """Starts sending all timings and counts to sink"""
+
+    global _active
+
+    with _lock:
+        _sinks.append(sink)
+        _active += 1
+
+
+def remove_sink(sink: Sink):
+    global _active
+
+    with _lock:
+        _sinks.remove(sink)
+        _active -= 1
+
+
+def is_enabled() -> bool:
+    """Whether anything is recorded at the moment"""
+    return _active > 0
+
+
+def _record(name: str, seconds: float):
+    for _sink in list(_sinks):
+        _sink.timing(name, seconds)
+
+    for _breakdown in _breakdowns():
+        _breakdown._timing(name, seconds)
+
+
+class _Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        _record(self.name, perf_counter() - self.start)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str):
+    """Context manager which records the time of its block under name"""
+
+    if not _active:
+        return _NULL_TIMER
+
+    return _Timer(name)
+
+
+def timed(name: str):
+    """Decorator which records the time of every call under name"""
+
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            if not _active:
+                return func(*args, **kwargs)
+
+            _start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, perf_counter() - _start)
+
+        return _wrapper
+
+    return _decorator
+
+
+def count(name: str, value: int = 1):
+    """Adds value to the counter name"""
+
+    if not _active:
+        return
+
+    for _sink in list(_sinks):
+        _sink.count(name, value)
+
+    for _breakdown in _breakdowns():
+        _breakdown._count(name, value)
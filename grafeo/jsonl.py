@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import itertools
+import collections
+import concurrent.futures
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from . import BaseDB, BaseProd, Producer, Product, validate_many
+
+
+"""The kinds of records in a json lines file"""
+_KINDS = {
+    'producer': Producer,
+    'product': Product
+}
+
+
+class TransferStats(object):
+    """Counters of a running or finished import/export"""
+
+    def __init__(self):
+        self.records = 0  # type: int
+        self.accepted = 0  # type: int
+        self.rejected = 0  # type: int
+        self._start = time.monotonic()  # type: float
+        self.seconds = 0.0  # type: float
+
+    def _tick(self):
+        self.seconds = time.monotonic() - self._start
+
+    @property
+    def per_second(self) -> float:
+        """Records handled per second"""
+        return self.records / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return 'TransferStats(records={}, accepted={}, rejected={}, seconds={:.3f}, per_second={:.1f})'.format(
+            self.records, self.accepted, self.rejected, self.seconds, self.per_second
+        )
+
+
+def _to_line(prod: BaseProd, private_keys: bool) -> str:
+    _record = prod.to_dict()  # type: Dict[str, Any]
+    if not private_keys or not _record.get('priv_key'):
+        _record.pop('priv_key', None)
+
+    return json.dumps({
+        'kind': 'producer' if isinstance(prod, Producer) else 'product',
+        'record': _record
+    }, separators=(',', ':')) + '\n'
+
+
+def _from_line(line: str) -> Optional[BaseProd]:
+    try:
+        _data = json.loads(line)
+        _record = dict(_data['record'])
+        _priv_key = _record.pop('priv_key', '')
+
+        # Without a public key the constructor would make up a new, validly signed record
+        if not _record.get('pub_key'):
+            return None
+
+        _prod = _KINDS[_data['kind']](**_record)  # type: BaseProd
+        _prod.priv_key = _priv_key
+        return _prod
+
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def _chunks(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    _iterator = iter(iterable)
+    while True:
+        _chunk = list(itertools.islice(_iterator, size))
+        if not _chunk:
+            return
+        yield _chunk
+
+
+def read_jsonl(path: str) -> Iterator[Optional[BaseProd]]:
+    """Reads a json lines file record by record
+
+    :param path: the file written by export_jsonl
+    :returns a generator of produc(er/t)s, None for lines which could not be parsed
+    """
+
+    with open(path, 'r', encoding='utf-8') as _f:
+        for _line in _f:
+            if _line.strip():
+                yield _from_line(_line)
+
+
+def export_jsonl(db: BaseDB,
+                 path: str,
+                 pub_keys: Optional[Iterable[str]] = None,
+                 private_keys: bool = False,
+                 progress: Optional[Callable[[TransferStats], None]] = None,
+                 progress_every: int = 10000) -> TransferStats:
+    """Writes produc(er/t)s of a database to a json lines file, one record per line
+
+    :param db: the database
+    :param path: the file to write
+    :param pub_keys: the produc(er/t)s to export, by default everything from db.producers() and db.products()
+    :param private_keys: also export private keys, the file then has to be kept secret
+    :param progress: called with the counters every progress_every records and at the end
+    :param progress_every: see progress
+    :returns the counters
+    """
+
+    if pub_keys is not None:
+        _prods = (db.get_product(_pub_key) or db.get_producer(_pub_key) for _pub_key in pub_keys)
+    elif hasattr(db, 'producers') and hasattr(db, 'products'):
+        _prods = itertools.chain(db.producers(), db.products())
+    else:
+        raise TypeError('{} can not list its records, pass pub_keys'.format(type(db).__name__))
+
+    _stats = TransferStats()
+
+    with open(path, 'w', encoding='utf-8') as _f:
+        for _prod in _prods:
+            _stats.records += 1
+
+            if _prod is None:
+                _stats.rejected += 1
+            else:
+                _f.write(_to_line(_prod, private_keys))
+                _stats.accepted += 1
+
+            if progress is not None and _stats.records % progress_every == 0:
+                _stats._tick()
+                progress(_stats)
+
+    _stats._tick()
+    if progress is not None:
+        progress(_stats)
+
+    return _stats
+
+
+def import_jsonl(db: BaseDB,
+                 path: str,
+                 validate: bool = True,
+                 workers: Optional[int] = None,
+                 chunk_size: int = 1000,
+                 progress: Optional[Callable[[TransferStats], None]] = None) -> TransferStats:
+    """Posts all produc(er/t)s from a json lines file to a database
+
+    The file is streamed in chunks of chunk_size records. Each chunk is
+    validated on a pool of worker processes and its valid records are then
+    posted with db.post_many, which does not validate them a second time.
+    At most two chunks per worker are in memory at once.
+
+    :param db: the database
+    :param path: the file written by export_jsonl
+    :param validate: validate the records, only switch this off for files from a trusted source
+    :param workers: number of worker processes, defaults to the number of cpus. With 1 no pool is used
+    :param chunk_size: number of records validated and posted at once
+    :param progress: called with the counters after every chunk
+    :returns the counters, rejected records were malformed, invalid or not accepted by the database
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    _stats = TransferStats()
+    _pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if validate and workers > 1 else None
+    _in_flight = collections.deque()  # type: collections.deque
+
+    def _post(chunk: List[Optional[BaseProd]], valid: List[bool]):
+        _valid = [_prod for _prod, _ok in zip(chunk, valid) if _ok]  # type: List[BaseProd]
+        _accepted = sum(db.post_many(_valid, validate=False))  # type: int
+
+        _stats.records += len(chunk)
+        _stats.accepted += _accepted
+        _stats.rejected += len(chunk) - _accepted
+        _stats._tick()
+
+        if progress is not None:
+            progress(_stats)
+
+    try:
+        for _chunk in _chunks(read_jsonl(path), chunk_size):
+            if not validate:
+                _post(_chunk, [_prod is not None for _prod in _chunk])
+            elif _pool is None:
+                _post(_chunk, validate_many(_chunk))
+            else:
+                _in_flight.append((_chunk, _pool.submit(validate_many, _chunk)))
+                if len(_in_flight) >= 2 * workers:
+                    _chunk, _future = _in_flight.popleft()
+                    _post(_chunk, _future.result())
+
+        while _in_flight:
+            _chunk, _future = _in_flight.popleft()
+            _post(_chunk, _future.result())
+
+    finally:
+        if _pool is not None:
+            _pool.shutdown()
+
+    return _stats
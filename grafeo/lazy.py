@@ -0,0 +1,100 @@
+from typing import Any, Optional
+from . import BaseProd
+
+
+"""Fields which may be shown before the signatures were checked
+
+The public key is what the record was requested by, RemoteDB drops records
+which come back under another key. The others are only labels. Everything else makes a statement about provenance.
+"""
+_DISPLAY_FIELDS = frozenset(['pub_key', 'name', 'version_major', 'version_minor', 'version_patch'])
+
+
+class InvalidRecordError(ValueError):
+    """A trust-sensitive attribute of a LazyRecord was read, but the record is not valid"""
+    pass
+
+
+class LazyRecord(object):
+    """A fetched produc(er/t) whose signatures are only checked when it matters
+
+    pub_key, name and the version can be read right away. Calling
+    is_valid() or verify(), or reading any other attribute (signatures,
+    producer, inputs, to_dict, ...), verifies the record once and remembers
+    the result. Reading such an attribute of an invalid record raises
+    InvalidRecordError, is_valid() and verify() just return False.
+    isinstance sees the class of the wrapped record.
+    """
+
+    __slots__ = ('_record', '_valid')
+
+    def __init__(self, record: BaseProd, valid: Optional[bool] = None):
+        """Wraps a record
+
+        :param record: the unverified produc(er/t)
+        :param valid: the result of an earlier verification, None if it was not verified yet
+        """
+
+        object.__setattr__(self, '_record', record)
+        object.__setattr__(self, '_valid', valid)
+
+    @property
+    def __class__(self):
+        return type(self._record)
+
+    @property
+    def verified(self) -> bool:
+        """Whether the signatures were already checked"""
+        return self._valid is not None
+
+    def verify(self) -> bool:
+        """Checks the signatures unless that happened before
+
+        :returns True if the record is valid
+        """
+
+        if self._valid is None:
+            object.__setattr__(self, '_valid', self._record.is_valid())
+
+        return self._valid
+
+    def is_valid(self) -> bool:
+        return self.verify()
+
+    def unwrap(self) -> BaseProd:
+        """Returns the wrapped record once it is verified
+
+        :raises InvalidRecordError: if it is not valid
+        """
+
+        if not self.verify():
+            raise InvalidRecordError('{} is not valid'.format(self._record.pub_key))
+
+        return self._record
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for what the proxy does not have itself
+        if name in _DISPLAY_FIELDS:
+            return getattr(self._record, name)
+
+        return getattr(self.unwrap(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError('LazyRecord is read only, unwrap() it first')
+
+    def __reduce_ex__(self, protocol: int):
+        # pickle would take the wrapped class from __class__ and refuse the proxy.
+        # A valid record is pickled as itself, otherwise the proxy keeps its state
+        if self._valid:
+            return self._record.__reduce_ex__(protocol)
+
+        return LazyRecord, (self._record, self._valid)
+
+    def __str__(self):
+        return str(self._record)
+
+    def __repr__(self):
+        return '<LazyRecord {} {}>'.format(
+            type(self._record).__name__,
+            {None: 'unverified', True: 'valid', False: 'invalid'}[self._valid]
+        )
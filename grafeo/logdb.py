@@ -0,0 +1,285 @@
+import os
+import zlib
+import atexit
+import pickle
+import struct
+import threading
+import contextlib
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from . import BaseDB, BaseProd, Producer, Product, validate_many
+
+
+"""Every log file starts with the magic followed by a random 16 byte id"""
+_MAGIC = b'GRAFEOLOG1\n'
+_ID_SIZE = 16
+
+"""Every record starts with this header: payload length, crc32 of the payload, kind, raw public key"""
+_HEADER = struct.Struct('>IIB32s')
+
+_KINDS = [(Producer, 'producers'), (Product, 'products')]
+
+
+def _kind_of(prod: BaseProd) -> Optional[int]:
+    for _kind, (_cls, _name) in enumerate(_KINDS):
+        if isinstance(prod, _cls):
+            return _kind
+    return None
+
+
+class LogDB(BaseDB):
+    """Local database which appends every post to a log file
+
+    Every post is written to the end of the log as soon as it happens, so
+    a post costs O(record) and nothing is lost on a crash. Only an index of
+    public key to file offset is kept in memory, records are read from disk
+    on every get.
+
+    The index is checkpointed to a side file on close and compaction.
+    On open only the records behind the checkpoint are replayed, a torn
+    record at the end of the log is cut off. Records which were overwritten
+    by newer posts are dropped by compact().
+    Like LocalDB this stores private keys, so the folder has to be kept secret.
+    """
+
+    def __init__(self,
+                 folderpath: str,
+                 filename: str = 'grafeo_local_db.log',
+                 compact_ratio: float = 0.5,
+                 compact_min_size: int = 1 << 20,
+                 sync: bool = False):
+        """Opens or creates the log
+
+        :param folderpath: folder of the log file
+        :param filename: name of the log file, the index checkpoint is stored next to it
+        :param compact_ratio: compact automatically once this fraction of the log is overwritten records
+        :param compact_min_size: but only if the log is at least that many bytes large
+        :param sync: fsync after every post
+        """
+
+        self._filename = os.path.abspath(os.path.join(folderpath, filename))  # type: str
+        self._index_filename = self._filename + '.idx'  # type: str
+        self.compact_ratio = compact_ratio  # type: float
+        self.compact_min_size = compact_min_size  # type: int
+        self.sync = sync  # type: bool
+
+        self._lock = threading.RLock()
+        self._file = None
+        self._open()
+
+        atexit.register(self.close)
+
+    def _open(self, truncate: bool = True):
+        """Opens the log, truncate is for writers, who may also create a missing log and cut off a torn record"""
+
+        if truncate and (
+            not os.path.exists(self._filename) or os.path.getsize(self._filename) < len(_MAGIC) + _ID_SIZE
+        ):
+            self._create(self._filename)
+
+        self._file = open(self._filename, 'r+b')
+        self._file.seek(0)
+        if self._file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError('{} is not a grafeo log'.format(self._filename))
+        self._id = self._file.read(_ID_SIZE)  # type: bytes
+
+        self._index = {_name: {} for _cls, _name in _KINDS}  # type: Dict[str, Dict[str, Tuple[int, int]]]
+        self._dead = 0  # type: int
+        self._end = len(_MAGIC) + _ID_SIZE  # type: int
+
+        self._load_checkpoint()
+        self._replay(truncate=truncate)
+
+    @staticmethod
+    def _create(filename: str):
+        with open(filename, 'wb') as _f:
+            _f.write(_MAGIC + os.urandom(_ID_SIZE))
+            _f.flush()
+            os.fsync(_f.fileno())
+
+    def _load_checkpoint(self):
+        """Loads the index checkpoint if it belongs to the current log and is intact"""
+
+        # A damaged checkpoint is treated like a missing one, the whole log is replayed
+        try:
+            with open(self._index_filename, 'rb') as _f:
+                _checkpoint = pickle.load(_f)
+
+            if _checkpoint['id'] != self._id or _checkpoint['end'] > os.path.getsize(self._filename):
+                return
+
+            _index = {_name: dict(_checkpoint['index'][_name]) for _cls, _name in _KINDS}
+            _dead = int(_checkpoint['dead'])
+            _end = int(_checkpoint['end'])
+        except Exception:
+            return
+
+        self._index, self._dead, self._end = _index, _dead, _end
+
+    def _save_checkpoint(self):
+        _tmp = self._index_filename + '.tmp'
+        with open(_tmp, 'wb') as _f:
+            pickle.dump({
+                'id': self._id,
+                'end': self._end,
+                'dead': self._dead,
+                'index': self._index
+            }, _f)
+        os.replace(_tmp, self._index_filename)
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive: bool = True):
+        """Guards the file and the index, exclusive is for writers"""
+
+        with self._lock:
+            yield
+
+    def _replay(self, truncate: bool = True):
+        """Adds all records behind the checkpoint to the index, cuts off a torn record if truncate"""
+
+        _size = os.path.getsize(self._filename)  # type: int
+        self._file.seek(self._end)
+
+        while self._end + _HEADER.size <= _size:
+            _length, _crc, _kind, _pub_key = _HEADER.unpack(self._file.read(_HEADER.size))
+
+            if _kind >= len(_KINDS) or self._end + _HEADER.size + _length > _size:
+                break
+
+            if zlib.crc32(self._file.read(_length)) != _crc:
+                break
+
+            self._add_to_index(_kind, _pub_key.hex(), self._end, _HEADER.size + _length)
+
+        if truncate and self._end != _size:
+            self._file.truncate(self._end)
+
+    def _add_to_index(self, kind: int, pub_key: str, offset: int, size: int):
+        _index = self._index[_KINDS[kind][1]]
+
+        if pub_key in _index:
+            self._dead += _index[pub_key][1]
+
+        _index[pub_key] = (offset, size)
+        self._end = offset + size
+
+    def close(self):
+        """Checkpoints the index and closes the log"""
+
+        with self._locked():
+            if self._file is None:
+                return
+
+            self._save_checkpoint()
+            self._file.close()
+            self._file = None
+
+    def _read(self, name: str, pub_key: str) -> Optional[BaseProd]:
+        with self._locked(exclusive=False):
+            _entry = self._index[name].get(pub_key)
+            if _entry is None:
+                return None
+
+            self._file.seek(_entry[0] + _HEADER.size)
+            return pickle.loads(self._file.read(_entry[1] - _HEADER.size))
+
+    def get_producer(self, pub_key: str):
+        return self._read('producers', pub_key)
+
+    def get_product(self, pub_key: str):
+        return self._read('products', pub_key)
+
+    def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        # Even without validation the key has to fit into the record header
+        if _kind_of(prod) is None or not (prod.is_valid() if validate else prod._is_well_formed()):
+            return False
+
+        self._append([prod])
+        return True
+
+    def post_many(self, prods: List[BaseProd], validate: bool = True) -> List[bool]:
+        """Validates all produc(er/t)s together and appends the valid ones with one write
+
+        :returns for each produc(er/t) True if it was stored
+        """
+
+        _results = [_kind_of(_prod) is not None for _prod in prods]  # type: List[bool]
+
+        if validate:
+            _results = [_ok and _valid for _ok, _valid in zip(_results, validate_many(prods))]
+        else:
+            _results = [_ok and _prod._is_well_formed() for _ok, _prod in zip(_results, prods)]
+
+        self._append([_prod for _prod, _ok in zip(prods, _results) if _ok])
+        return _results
+
+    def _append(self, prods: List[BaseProd]):
+        """Appends well formed produc(er/t)s to the log"""
+
+        if not prods:
+            return
+
+        _records = []  # type: List[Tuple[int, str, bytes]]
+        for _prod in prods:
+            _payload = pickle.dumps(_prod, protocol=pickle.HIGHEST_PROTOCOL)  # type: bytes
+            _kind = _kind_of(_prod)  # type: int
+            _records.append((_kind, _prod.pub_key, _HEADER.pack(
+                len(_payload), zlib.crc32(_payload), _kind, bytes.fromhex(_prod.pub_key)
+            ) + _payload))
+
+        with self._locked():
+            self._file.seek(self._end)
+            self._file.write(b''.join(_record for _kind, _pub_key, _record in _records))
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+            for _kind, _pub_key, _record in _records:
+                self._add_to_index(_kind, _pub_key, self._end, len(_record))
+
+            if self._end >= self.compact_min_size and self._dead >= self.compact_ratio * self._end:
+                self.compact()
+
+    def compact(self):
+        """Rewrites the log without overwritten records"""
+
+        with self._locked():
+            _tmp = self._filename + '.tmp'
+            self._create(_tmp)
+
+            with open(_tmp, 'r+b') as _f:
+                _f.read(len(_MAGIC))
+                _id = _f.read(_ID_SIZE)
+                _index = {_name: {} for _cls, _name in _KINDS}  # type: Dict[str, Dict[str, Tuple[int, int]]]
+
+                for _cls, _name in _KINDS:
+                    for _pub_key, (_offset, _size) in self._index[_name].items():
+                        self._file.seek(_offset)
+                        _index[_name][_pub_key] = (_f.tell(), _size)
+                        _f.write(self._file.read(_size))
+
+                _end = _f.tell()
+                _f.flush()
+                os.fsync(_f.fileno())
+
+            self._file.close()
+            os.replace(_tmp, self._filename)
+
+            self._file = open(self._filename, 'r+b')
+            self._id, self._index, self._dead, self._end = _id, _index, 0, _end
+            self._save_checkpoint()
+
+    def _iter(self, name: str) -> Iterator[BaseProd]:
+        with self._locked(exclusive=False):
+            _keys = list(self._index[name])
+
+        for _pub_key in _keys:
+            _prod = self._read(name, _pub_key)
+            if _prod is not None:
+                yield _prod
+
+    def producers(self):
+        return self._iter('producers')
+
+    def products(self):
+        return self._iter('products')
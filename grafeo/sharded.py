@@ -0,0 +1,218 @@
+import os
+import json
+import itertools
+import contextlib
+
+from typing import Dict, Iterator, List, Optional
+from . import BaseDB, BaseProd, Producer, Product, validate_many
+from .crypto import check_pub_key
+from .logdb import LogDB, _kind_of
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Without fcntl (Windows) the shards are only safe within one process
+    fcntl = None
+
+
+class _Shard(LogDB):
+    """A LogDB which several processes may open at the same time
+
+    Every access holds an flock on a lock file next to the log, writers
+    exclusively. Before each access the records which other processes
+    appended in the meantime are replayed, and a log which another process
+    compacted is reopened.
+    """
+
+    def __init__(self, folderpath: str, filename: str, **kwargs):
+        self._lock_file = open(os.path.join(folderpath, filename + '.lock'), 'a+b')
+        self._depth = 0  # type: int
+        self._exclusive = False  # type: bool
+
+        super().__init__(folderpath, filename=filename, **kwargs)
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive: bool = True):
+        with self._lock:
+            # Only the outermost access takes the flock, nested ones (compact in a post) run under it
+            if self._depth > 0:
+                assert self._exclusive or not exclusive, 'a reader may not write'
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._depth, self._exclusive = 1, exclusive
+
+            try:
+                self._catch_up()
+                yield
+            finally:
+                self._depth = 0
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open(self, truncate: bool = True):
+        with self._locked():
+            super()._open(truncate=truncate)
+
+    def _catch_up(self):
+        """Brings the index up to date with what other processes did to the log"""
+
+        if self._file is None:
+            return
+
+        try:
+            _replaced = os.stat(self._filename).st_ino != os.fstat(self._file.fileno()).st_ino  # type: bool
+        except FileNotFoundError:
+            _replaced = True
+
+        # Only writers may cut off a torn record, readers just stop before it
+        if _replaced:
+            self._file.close()
+            self._file = None
+            LogDB._open(self, truncate=self._exclusive)
+        elif os.path.getsize(self._filename) > self._end:
+            self._replay(truncate=self._exclusive)
+
+    def close(self):
+        if self._lock_file.closed:
+            return
+
+        super().close()
+        self._lock_file.close()
+
+
+class ShardedDB(BaseDB):
+    """Local database split into shards by the first bytes of the public key
+
+    Every shard is a log file with its own lock, so threads and processes
+    which post to different shards do not wait for each other. Public keys
+    are uniformly random, thus the records spread evenly over the shards.
+    Any number of processes may open the same folder, each sees what the
+    others posted, see LogDB for the file format.
+    The number of shards is fixed when the folder is created.
+    Like LocalDB this stores private keys, so the folder has to be kept secret.
+    """
+
+    def __init__(self, folderpath: str, shards: int = 16, sync: bool = False):
+        """Opens or creates the shards in a folder
+
+        :param folderpath: folder of the shard files, created if missing
+        :param shards: number of shards of a new folder, an existing folder keeps its number
+        :param sync: fsync after every post
+        :raises ValueError: if shards does not match the existing folder
+        """
+
+        if not 0 < shards <= 1 << 16:
+            raise ValueError('shards must be between 1 and 65536')
+
+        os.makedirs(folderpath, exist_ok=True)
+        self.shards = self._shard_count(folderpath, shards)  # type: int
+
+        self._shards = [
+            _Shard(folderpath, filename='grafeo_shard_{:05d}.log'.format(_i), sync=sync)
+            for _i in range(self.shards)
+        ]  # type: List[_Shard]
+
+    @staticmethod
+    def _shard_count(folderpath: str, shards: int) -> int:
+        """Stores the number of shards of a new folder, checks it for an existing one"""
+
+        _path = os.path.join(folderpath, 'grafeo_shards.json')
+
+        if not os.path.exists(_path):
+            _tmp = '{}.{}.tmp'.format(_path, os.getpid())
+            with open(_tmp, 'w') as _f:
+                json.dump({'shards': shards}, _f)
+            try:
+                # The first process to create the folder wins
+                os.link(_tmp, _path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(_tmp)
+
+        with open(_path, 'r') as _f:
+            _shards = json.load(_f)['shards']  # type: int
+
+        if _shards != shards:
+            raise ValueError('{} has {} shards, not {}'.format(folderpath, _shards, shards))
+
+        return _shards
+
+    def _shard_index(self, pub_key: str) -> Optional[int]:
+        """Returns the number of the shard of a public key, None for malformed keys"""
+
+        if not check_pub_key(pub_key):
+            return None
+
+        return int(pub_key[:8], 16) % self.shards
+
+    def _shard(self, pub_key: str) -> Optional[_Shard]:
+        _index = self._shard_index(pub_key)
+        return None if _index is None else self._shards[_index]
+
+    def close(self):
+        for _shard in self._shards:
+            _shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_producer(self, pub_key: str):
+        _shard = self._shard(pub_key)
+        return None if _shard is None else _shard.get_producer(pub_key)
+
+    def get_product(self, pub_key: str):
+        _shard = self._shard(pub_key)
+        return None if _shard is None else _shard.get_product(pub_key)
+
+    def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        if _kind_of(prod) is None:
+            return False
+
+        _shard = self._shard(prod.pub_key)
+        return _shard is not None and _shard.post(prod, validate=validate)
+
+    def post_many(self, prods: List[BaseProd], validate: bool = True) -> List[bool]:
+        """Validates all produc(er/t)s together and appends the valid ones with one write per shard
+
+        :returns for each produc(er/t) True if it was stored
+        """
+
+        _results = validate_many(prods) if validate else [_kind_of(_prod) is not None for _prod in prods]
+        _by_shard = {}  # type: Dict[int, List[int]]
+
+        for _i, _prod in enumerate(prods):
+            _shard = self._shard_index(_prod.pub_key) if _results[_i] else None
+            if _shard is None:
+                _results[_i] = False
+            else:
+                _by_shard.setdefault(_shard, []).append(_i)
+
+        for _shard, _indices in _by_shard.items():
+            _stored = self._shards[_shard].post_many([prods[_i] for _i in _indices], validate=False)
+            for _i, _ok in zip(_indices, _stored):
+                _results[_i] = _ok
+
+        return _results
+
+    def compact(self):
+        """Compacts every shard"""
+
+        for _shard in self._shards:
+            _shard.compact()
+
+    def producers(self) -> Iterator[Producer]:
+        return itertools.chain.from_iterable(_shard.producers() for _shard in self._shards)
+
+    def products(self) -> Iterator[Product]:
+        return itertools.chain.from_iterable(_shard.products() for _shard in self._shards)
@@ -0,0 +1,183 @@
+import os
+import mmap
+import bisect
+import struct
+
+from typing import Iterable, Iterator, List, Optional, Tuple
+from . import BaseDB, BaseProd, Producer, Product, freeze, wire
+
+
+"""A snapshot file is laid out as
+
+    header: magic, then for producers and products the number of records and the offset of their index
+    records: produc(er/t)s in the binary format of grafeo.wire
+    index of the producers, index of the products
+
+Every index is sorted by public key and has one fixed size entry per
+record: the raw 32 byte public key, offset and length of the record.
+"""
+_MAGIC = b'GRAFEOSNAP1\n'
+_HEADER = struct.Struct('>12sQQQQ')
+_ENTRY = struct.Struct('>32sQI')
+
+_KINDS = [Producer, Product]
+
+
+class _Keys(object):
+    """The public keys of an index as a sequence, for bisect"""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int):
+        self._buffer = buffer
+        self._offset = offset  # type: int
+        self._count = count  # type: int
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i: int) -> bytes:
+        _start = self._offset + i * _ENTRY.size  # type: int
+        return self._buffer[_start:_start + 32]
+
+
+def export_snapshot(db: BaseDB, path: str, prods: Optional[Iterable[BaseProd]] = None) -> int:
+    """Writes the produc(er/t)s of a database to a snapshot file which SnapshotDB can open
+
+    Private keys are not exported. The file is written to a temporary name
+    and renamed, readers of an older snapshot at path keep their version.
+
+    :param db: the database, it has to offer producers() and products() unless prods is given
+    :param path: the file to write
+    :param prods: the produc(er/t)s to export instead of everything in db
+    :returns the number of exported records
+    """
+
+    if prods is None:
+        prods = list(db.producers()) + list(db.products())
+
+    _entries = ([], [])  # type: Tuple[List[Tuple[bytes, int, int]], List[Tuple[bytes, int, int]]]
+    _tmp = path + '.tmp'
+
+    with open(_tmp, 'wb') as _f:
+        _f.write(b'\0' * _HEADER.size)
+
+        for _prod in prods:
+            for _kind, _cls in enumerate(_KINDS):
+                if isinstance(_prod, _cls):
+                    break
+            else:
+                continue
+
+            try:
+                _record = wire.encode(_prod)  # type: bytes
+            except ValueError:
+                continue
+
+            _entries[_kind].append((bytes.fromhex(_prod.pub_key), _f.tell(), len(_record)))
+            _f.write(_record)
+
+        _indices = []  # type: List[Tuple[int, int]]
+        for _kind_entries in _entries:
+            # Later posts of the same key win, like in the databases
+            _unique = dict((_entry[0], _entry) for _entry in _kind_entries)
+            _indices.append((len(_unique), _f.tell()))
+            _f.write(b''.join(_ENTRY.pack(*_unique[_key]) for _key in sorted(_unique)))
+
+        _f.seek(0)
+        _f.write(_HEADER.pack(_MAGIC, _indices[0][0], _indices[0][1], _indices[1][0], _indices[1][1]))
+        _f.flush()
+        os.fsync(_f.fileno())
+
+    os.replace(_tmp, path)
+
+    return _indices[0][0] + _indices[1][0]
+
+
+class SnapshotDB(BaseDB):
+    """Read-only database on a snapshot file written by export_snapshot
+
+    The file is memory-mapped, opening it only reads the header. A get is a
+    binary search in the sorted index and decodes just the record found, so
+    it touches a handful of pages. Processes which open the same snapshot
+    share these pages through the page cache.
+    Records are returned frozen and without private keys, posts are refused.
+    """
+
+    def __init__(self, path: str):
+        """Opens a snapshot
+
+        :param path: the file written by export_snapshot
+        :raises ValueError: if the file is no snapshot
+        """
+
+        self._file = open(path, 'rb')
+
+        try:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be mapped
+            self._file.close()
+            raise ValueError('{} is not a grafeo snapshot'.format(path))
+
+        if len(self._buffer) < _HEADER.size or self._buffer[:len(_MAGIC)] != _MAGIC:
+            self.close()
+            raise ValueError('{} is not a grafeo snapshot'.format(path))
+
+        _magic, _num_producers, _producers, _num_products, _products = _HEADER.unpack_from(self._buffer)
+        self._keys = [
+            _Keys(self._buffer, _producers, _num_producers),
+            _Keys(self._buffer, _products, _num_products)
+        ]  # type: List[_Keys]
+
+        for _keys in self._keys:
+            if _keys._offset + len(_keys) * _ENTRY.size > len(self._buffer):
+                self.close()
+                raise ValueError('{} is truncated'.format(path))
+
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return sum(len(_keys) for _keys in self._keys)
+
+    def _record(self, kind: int, i: int) -> BaseProd:
+        _key, _offset, _length = _ENTRY.unpack_from(self._buffer, self._keys[kind]._offset + i * _ENTRY.size)
+        return freeze(wire.decode(self._buffer[_offset:_offset + _length]))
+
+    def _get(self, kind: int, pub_key: str) -> Optional[BaseProd]:
+        try:
+            _key = bytes.fromhex(pub_key)  # type: bytes
+        except (ValueError, TypeError):
+            return None
+
+        _keys = self._keys[kind]  # type: _Keys
+        _i = bisect.bisect_left(_keys, _key)  # type: int
+
+        if _i == len(_keys) or _keys[_i] != _key:
+            return None
+
+        return self._record(kind, _i)
+
+    def get_producer(self, pub_key: str):
+        return self._get(0, pub_key)
+
+    def get_product(self, pub_key: str):
+        return self._get(1, pub_key)
+
+    def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        """Snapshots are immutable, nothing can be posted"""
+        return False
+
+    def producers(self) -> Iterator[Producer]:
+        """All producers, ordered by public key"""
+        return (self._record(0, _i) for _i in range(len(self._keys[0])))
+
+    def products(self) -> Iterator[Product]:
+        """All products, ordered by public key"""
+        return (self._record(1, _i) for _i in range(len(self._keys[1])))
@@ -0,0 +1,254 @@
+import os
+import sqlite3
+import threading
+
+from typing import Iterator, List, Optional
+from . import BaseDB, BaseProd, Producer, Product, validate_many, _read_local_db
+from .crypto import check_pub_key
+
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS producers (
+        pub_key BLOB PRIMARY KEY,
+        priv_key BLOB,
+        version_major INTEGER NOT NULL,
+        version_minor INTEGER NOT NULL,
+        version_patch INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        signature BLOB NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS products (
+        pub_key BLOB PRIMARY KEY,
+        priv_key BLOB,
+        version_major INTEGER NOT NULL,
+        version_minor INTEGER NOT NULL,
+        version_patch INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        signature BLOB NOT NULL,
+        producer_pub_key BLOB NOT NULL,
+        producer_signature BLOB NOT NULL
+    )""",
+    """CREATE INDEX IF NOT EXISTS products_producer_pub_key ON products (producer_pub_key)""",
+    """CREATE TABLE IF NOT EXISTS product_inputs (
+        product_pub_key BLOB NOT NULL,
+        position INTEGER NOT NULL,
+        input_pub_key BLOB NOT NULL,
+        input_signature BLOB NOT NULL,
+        PRIMARY KEY (product_pub_key, position)
+    ) WITHOUT ROWID""",
+    """CREATE INDEX IF NOT EXISTS product_inputs_input_pub_key ON product_inputs (input_pub_key)""",
+]
+
+# The statements are constant strings, so sqlite3 prepares each of them only once
+_INSERT_PRODUCER = """INSERT OR REPLACE INTO producers
+    (pub_key, priv_key, version_major, version_minor, version_patch, name, signature)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+_INSERT_PRODUCT = """INSERT OR REPLACE INTO products
+    (pub_key, priv_key, version_major, version_minor, version_patch, name, signature,
+     producer_pub_key, producer_signature)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+_DELETE_INPUTS = """DELETE FROM product_inputs WHERE product_pub_key = ?"""
+_INSERT_INPUT = """INSERT INTO product_inputs
+    (product_pub_key, position, input_pub_key, input_signature)
+    VALUES (?, ?, ?, ?)"""
+
+_PRODUCER_COLUMNS = "pub_key, priv_key, version_major, version_minor, version_patch, name, signature"
+_PRODUCT_COLUMNS = _PRODUCER_COLUMNS + ", producer_pub_key, producer_signature"
+_SELECT_PRODUCER = "SELECT " + _PRODUCER_COLUMNS + " FROM producers WHERE pub_key = ?"
+_SELECT_PRODUCT = "SELECT " + _PRODUCT_COLUMNS + " FROM products WHERE pub_key = ?"
+_SELECT_INPUTS = """SELECT input_pub_key, input_signature FROM product_inputs
+    WHERE product_pub_key = ? ORDER BY position"""
+_SELECT_USERS = """SELECT DISTINCT product_pub_key FROM product_inputs WHERE input_pub_key = ?"""
+
+
+def _blob(s: str) -> Optional[bytes]:
+    """hex-string to blob, empty strings (e.g. missing private keys) are stored as NULL"""
+    return bytes.fromhex(s) if s else None
+
+
+def _hex(b: Optional[bytes]) -> str:
+    return b.hex() if b else ''
+
+
+class SQLiteDB(BaseDB):
+    """Local database in a SQLite file
+
+    Keys and signatures are stored as blobs. The inputs of a product live in
+    their own table which is indexed by product and by input, so questions like
+    "which products used X" are answered without scanning all products.
+    The database runs in WAL mode, a post_many is a single transaction.
+    Like LocalDB this stores private keys, so the file has to be kept secret.
+    """
+
+    def __init__(self, path: str):
+        """Opens or creates the database
+
+        :param path: path of the SQLite file
+        """
+
+        self._path = os.path.abspath(path)  # type: str
+        self._lock = threading.RLock()
+
+        self._connection = sqlite3.connect(self._path, check_same_thread=False)  # type: sqlite3.Connection
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self._connection:
+            for _statement in _SCHEMA:
+                self._connection.execute(_statement)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_producer(self, pub_key: str):
+        if not check_pub_key(pub_key):
+            return None
+
+        with self._lock:
+            _row = self._connection.execute(_SELECT_PRODUCER, (_blob(pub_key),)).fetchone()
+
+        if _row is None:
+            return None
+
+        return self._producer(_row)
+
+    def get_product(self, pub_key: str):
+        if not check_pub_key(pub_key):
+            return None
+
+        with self._lock:
+            _row = self._connection.execute(_SELECT_PRODUCT, (_blob(pub_key),)).fetchone()
+            if _row is None:
+                return None
+            _inputs = self._connection.execute(_SELECT_INPUTS, (_row[0],)).fetchall()
+
+        return self._product(_row, _inputs)
+
+    @staticmethod
+    def _producer(row) -> Producer:
+        _producer = Producer(
+            pub_key=_hex(row[0]),
+            version_major=row[2],
+            version_minor=row[3],
+            version_patch=row[4],
+            name=row[5],
+            signature=_hex(row[6])
+        )
+        _producer.priv_key = _hex(row[1])
+        return _producer
+
+    @staticmethod
+    def _product(row, inputs) -> Product:
+        _product = Product(
+            pub_key=_hex(row[0]),
+            version_major=row[2],
+            version_minor=row[3],
+            version_patch=row[4],
+            name=row[5],
+            signature=_hex(row[6]),
+            producer_pub_key=_hex(row[7]),
+            producer_signature=_hex(row[8]),
+            input_pub_keys=[_hex(_input[0]) for _input in inputs],
+            input_signatures=[_hex(_input[1]) for _input in inputs]
+        )
+        _product.priv_key = _hex(row[1])
+        return _product
+
+    def post(self, prod: BaseProd, validate: bool = True) -> bool:
+        return self.post_many([prod], validate=validate)[0]
+
+    def post_many(self, prods: List[BaseProd], validate: bool = True) -> List[bool]:
+        """Validates all produc(er/t)s together and inserts the valid ones in one transaction
+
+        :returns for each produc(er/t) True if it was stored
+        """
+
+        if validate:
+            _results = validate_many(prods)  # type: List[bool]
+        else:
+            _results = [_prod._is_well_formed() if isinstance(_prod, (Producer, Product)) else False
+                        for _prod in prods]
+
+        _producers = []
+        _products = []
+        _inputs = []
+
+        for _prod, _valid in zip(prods, _results):
+            if not _valid:
+                continue
+
+            _row = (
+                _blob(_prod.pub_key),
+                _blob(_prod.priv_key),
+                _prod.version_major,
+                _prod.version_minor,
+                _prod.version_patch,
+                _prod.name,
+                _blob(_prod.signature)
+            )
+
+            if isinstance(_prod, Producer):
+                _producers.append(_row)
+            else:
+                _products.append(_row + (_blob(_prod.producer_pub_key), _blob(_prod.producer_signature)))
+                _inputs.extend(
+                    (_row[0], _position, _blob(_pub_key), _blob(_sig))
+                    for _position, (_pub_key, _sig) in enumerate(zip(_prod.input_pub_keys, _prod.input_signatures))
+                )
+
+        with self._lock, self._connection:
+            self._connection.executemany(_INSERT_PRODUCER, _producers)
+            self._connection.executemany(_INSERT_PRODUCT, _products)
+            self._connection.executemany(_DELETE_INPUTS, [(_row[0],) for _row in _products])
+            self._connection.executemany(_INSERT_INPUT, _inputs)
+
+        return _results
+
+    def products_with_input(self, pub_key: str) -> List[str]:
+        """Returns the public keys of all products which directly used the product pub_key as input"""
+
+        if not check_pub_key(pub_key):
+            return []
+
+        with self._lock:
+            _rows = self._connection.execute(_SELECT_USERS, (_blob(pub_key),)).fetchall()
+
+        return [_hex(_row[0]) for _row in _rows]
+
+    def producers(self) -> Iterator[Producer]:
+        with self._lock:
+            _rows = self._connection.execute("SELECT " + _PRODUCER_COLUMNS + " FROM producers").fetchall()
+
+        for _row in _rows:
+            yield self._producer(_row)
+
+    def products(self) -> Iterator[Product]:
+        with self._lock:
+            _keys = self._connection.execute("SELECT pub_key FROM products").fetchall()
+
+        for (_pub_key,) in _keys:
+            _product = self.get_product(_hex(_pub_key))
+            if _product is not None:
+                yield _product
+
+    def migrate_local_db(self, folderpath: str) -> int:
+        """Copies everything from the snapshot and deltas of a LocalDB into this database
+
+        The LocalDB files themselves are left untouched, changes which were not flushed yet are not copied.
+
+        :param folderpath: folder of the LocalDB
+        :returns the number of produc(er/t)s which were copied
+        """
+
+        _data, _last_delta = _read_local_db(os.path.join(os.path.abspath(folderpath), 'grafeo_local_db.p'))
+
+        _prods = list(_data['producers'].values()) + list(_data['products'].values())  # type: List[BaseProd]
+
+        return sum(self.post_many(_prods))
@@ -0,0 +1,206 @@
+import json
+import threading
+import socketserver
+import http.server
+
+from typing import Any, Dict, List, Optional
+from . import Producer, Product, validate_many, wire
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Implements the http protocol of a grafeo server on top of StandInServer's dicts"""
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately, with Nagle's algorithm every
+    # keep-alive response would wait for the delayed ack of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _route(self):
+        """Returns (collection name, class, rest of the path) or None"""
+
+        for _name, _cls in [('producer', Producer), ('product', Product)]:
+            _prefix = '/api/' + _name + '/'
+            if self.path.startswith(_prefix):
+                return _name + 's', _cls, self.path[len(_prefix):]
+
+        return None
+
+    def _send(self, status: int, body: bytes = b'', content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: Any):
+        self._send(status, json.dumps(data).encode('utf-8'))
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _accepts_binary(self) -> bool:
+        return self.server.standin.binary and wire.CONTENT_TYPE in self.headers.get('Accept', '')
+
+    def _sent_binary(self) -> bool:
+        return self.headers.get('Content-Type', '').split(';')[0].strip() == wire.CONTENT_TYPE
+
+    def do_GET(self):
+        _route = self._route()
+        if _route is None or not _route[2].endswith('.json'):
+            return self._send(404)
+
+        _collection, _cls, _rest = _route
+        _data = self.server.standin.get(_collection, _rest[:-len('.json')])
+
+        if _data is None:
+            return self._send(404)
+
+        if self._accepts_binary():
+            return self._send(200, wire.encode(_cls(**_data)), wire.CONTENT_TYPE)
+
+        self._send_json(200, _data)
+
+    def do_POST(self):
+        # Always consume the body, the connection is kept alive
+        _body = self._read_body()  # type: bytes
+
+        _route = self._route()
+        if _route is None or _route[2] not in ('', 'bulk/', 'lookup/'):
+            return self._send(404)
+
+        _collection, _cls, _rest = _route
+        _standin = self.server.standin
+
+        if _rest and not _standin.bulk:
+            return self._send(404)
+
+        if self._sent_binary() and not _standin.binary:
+            return self._send(415)
+
+        try:
+            if not self._sent_binary():
+                _data = json.loads(_body.decode('utf-8'))
+            elif _rest == 'bulk/':
+                _data = [_prod.to_dict() for _prod in wire.decode_batch(_body)]
+            else:
+                _data = wire.decode(_body).to_dict()
+        except (ValueError, AttributeError):
+            return self._send(400)
+
+        if _rest == 'lookup/':
+            if not isinstance(_data, list):
+                return self._send(400)
+
+            _records = [_standin.get(_collection, str(_pub_key)) for _pub_key in _data]
+            if self._accepts_binary():
+                return self._send(
+                    200, wire.encode_batch([_cls(**_r) if _r else None for _r in _records]), wire.CONTENT_TYPE
+                )
+            return self._send_json(200, _records)
+
+        if _rest == 'bulk/':
+            if not isinstance(_data, list):
+                return self._send(400)
+            return self._send_json(200, _standin.store_many(_collection, _cls, _data))
+
+        if not _standin.store(_collection, _cls, _data):
+            return self._send(400)
+
+        self._send(201)
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class StandInServer(object):
+    """A minimal in-process grafeo server for tests and benchmarks
+
+    It speaks the same /api/producer/ and /api/product/ protocol as the real
+    server, validates everything posted to it and keeps the records in memory.
+    Use it as a context manager, the url attribute is then ready for RemoteDB.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, bulk: bool = True, binary: bool = True):
+        """Create the server, it only listens after start()
+
+        :param host: interface to listen on
+        :param port: port to listen on, by default a free one is picked
+        :param bulk: whether the bulk/ and lookup/ endpoints are offered
+        :param binary: whether records in the format of grafeo.wire are understood and sent
+        """
+
+        self.bulk = bulk  # type: bool
+        self.binary = binary  # type: bool
+        self.records = {
+            'producers': {},
+            'products': {}
+        }  # type: Dict[str, Dict[str, Dict[str, Any]]]
+        self._lock = threading.Lock()
+
+        self._server = _Server((host, port), _Handler)
+        self._server.standin = self
+        self._thread = None  # type: Optional[threading.Thread]
+
+        self.url = 'http://{}:{}'.format(*self._server.server_address[:2])  # type: str
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get(self, collection: str, pub_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self.records[collection].get(pub_key)
+
+    def store(self, collection: str, cls, data: Dict[str, Any]) -> bool:
+        """Validates and stores a posted record, private keys are never stored"""
+
+        return self.store_many(collection, cls, [data])[0]
+
+    def store_many(self, collection: str, cls, data: List[Any]) -> List[bool]:
+        """Validates and stores many posted records
+
+        :returns for each record True if it was stored
+        """
+
+        _records = []  # type: List[Optional[Dict[str, Any]]]
+        _prods = []  # type: List[Any]
+
+        for _item in data:
+            _record, _prod = None, None
+
+            # Without a public key the constructor would make up a new, validly signed record
+            if isinstance(_item, dict) and _item.get('pub_key'):
+                _record = {_k: _v for _k, _v in _item.items() if _k != 'priv_key'}
+                try:
+                    _prod = cls(**_record)
+                except TypeError:
+                    _record = None
+
+            _records.append(_record)
+            _prods.append(_prod)
+
+        _results = validate_many(_prods)  # type: List[bool]
+
+        with self._lock:
+            for _record, _valid in zip(_records, _results):
+                if _valid:
+                    self.records[collection][_record['pub_key']] = _record
+
+        return _results
@@ -5,12 +5,60 @@ from .crypto import (
     check_pub_key,
     check_priv_key,
     generate_key_pair,
+    generate_key_pairs,
+    enable_key_pool,
+    disable_key_pool,
     sign_message,
+    sign_messages,
+    clear_signing_keys,
+    derive_pub_key,
     check_signature,
+    find_invalid_pub_key,
+    find_invalid_signature,
     validate_signed_message,
-
+    validate_signed_messages,
+    find_invalid_signed_message,
+    enable_signature_cache,
+    disable_signature_cache,
+    clear_signature_cache,
+    signature_cache_info,
 )
 from .common import separators
+from . import (
+    Producer,
+    Product,
+    FrozenProducer,
+    FrozenProduct,
+    freeze,
+    new_product,
+    validate_many,
+    validate_chain,
+    export_jsonl,
+    import_jsonl,
+    LocalDB,
+    LogDB,
+    SQLiteDB,
+    RemoteDB,
+    AsyncRemoteDB,
+    CachedDB,
+    DiskCache,
+    LazyRecord,
+    InvalidRecordError,
+    SnapshotDB,
+    ShardedDB,
+    export_snapshot,
+    _delta_files,
+)
+from .standin import StandInServer
+from . import wire
+from . import instrument
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import time
+import pytest
 
 
 test_data = {
@@ -62,6 +110,29 @@ test_data = {
 
 class TestCrypto(object):
 
+    def test_generate_key_pairs(self):
+        _pub_keys, _priv_keys = generate_key_pairs(5)
+        assert len(_pub_keys) == len(_priv_keys) == 5 * 32
+        assert generate_key_pairs(0) == (b'', b'')
+
+        for _i in range(0, 5 * 32, 32):
+            _priv_key = _priv_keys[_i:_i + 32].hex()
+            assert derive_pub_key(_priv_key) == _pub_keys[_i:_i + 32].hex()
+            assert validate_signed_message(_pub_keys[_i:_i + 32].hex(), 'message', sign_message(_priv_key, 'message'))
+
+    def test_key_pool(self):
+        enable_key_pool(size=8, batch_size=3)
+        try:
+            _producers = [Producer(name='Producer {}'.format(_i)) for _i in range(50)]
+        finally:
+            disable_key_pool()
+
+        assert len(set(_p.pub_key for _p in _producers)) == 50
+        assert all(_p.is_valid() and derive_pub_key(_p.priv_key) == _p.pub_key for _p in _producers)
+
+        with pytest.raises(ValueError):
+            enable_key_pool(size=0)
+
     def test_check_string(self):
         for _s in test_data['strings']:
             assert _check_string(_s)
@@ -92,6 +163,18 @@ class TestCrypto(object):
         for _ns in test_data['not_keys']:
             assert not check_priv_key(_ns)
 
+    def test_find_invalid_pub_key(self):
+        assert find_invalid_pub_key(test_data['keys'] * 50) == -1
+        assert find_invalid_pub_key([]) == -1
+
+        for _ns in test_data['not_keys'] + test_data['not_strings']:
+            assert find_invalid_pub_key(test_data['keys'] * 3 + [_ns] + test_data['not_keys']) == 6
+
+        _sig = sign_message(priv_key=generate_key_pair()['priv_key'], message='message')
+        assert find_invalid_signature([_sig] * 10) == -1
+        assert find_invalid_signature([_sig, _sig[:-1] + 'g', _sig[1:]]) == 1
+        assert find_invalid_signature(test_data['keys']) == 0
+
     def test_generate_key_pair(self):
         for i in range(1000):
             _keys = generate_key_pair()
@@ -121,3 +204,895 @@ class TestCrypto(object):
                 assert not check_signature(signature=_sig_wrong)
                 assert validate_signed_message(pub_key=_keys['pub_key'], message=_message, signature=_sig)
                 assert not validate_signed_message(pub_key=_keys['pub_key'], message=_message, signature=_sig_wrong1)
+
+    def test_validate_signed_messages(self):
+        _message = test_data['utf8_strings'][0]
+        _keys = [generate_key_pair() for i in range(20)]
+        _triples = [
+            (_k['pub_key'], _message, sign_message(priv_key=_k['priv_key'], message=_message))
+            for _k in _keys
+        ]
+
+        assert validate_signed_messages(_triples)
+        assert find_invalid_signed_message(_triples) == -1
+        assert validate_signed_messages([])
+
+        # Swapped signature is detected at the right position
+        _bad = list(_triples)
+        _bad[7] = (_bad[7][0], _message, _bad[8][2])
+        assert not validate_signed_messages(_bad)
+        assert find_invalid_signed_message(_bad) == 7
+
+        # Malformed entries are reported before any verification
+        _bad[12] = (test_data['not_keys'][0], _message, _bad[12][2])
+        assert find_invalid_signed_message(_bad) == 12
+        _bad[3] = (_bad[3][0], None, _bad[3][2])
+        assert find_invalid_signed_message(_bad) == 3
+
+    def test_sign_messages(self):
+        _message = test_data['utf8_strings'][0]
+        _keys = [generate_key_pair() for i in range(40)]
+        _priv_keys = [_k['priv_key'] for _k in _keys]
+
+        assert [derive_pub_key(_k['priv_key']) for _k in _keys] == [_k['pub_key'] for _k in _keys]
+
+        _signatures = [sign_message(priv_key=_priv_key, message=_message) for _priv_key in _priv_keys]
+        assert sign_messages(_priv_keys, _message, workers=1) == _signatures
+        assert sign_messages(_priv_keys, _message.encode('utf-8'), workers=3) == _signatures
+        assert sign_messages([], _message) == []
+
+        clear_signing_keys()
+        assert sign_messages(_priv_keys[:3], _message) == _signatures[:3]
+
+    def test_signature_cache(self):
+        _message = test_data['utf8_strings'][0]
+        _keys = [generate_key_pair() for i in range(4)]
+        _triples = [
+            (_k['pub_key'], _message, sign_message(priv_key=_k['priv_key'], message=_message))
+            for _k in _keys
+        ]
+
+        assert signature_cache_info().maxsize == 0
+
+        enable_signature_cache(maxsize=3)
+        try:
+            assert validate_signed_messages(_triples)
+            assert signature_cache_info() == (0, 4, 3, 3)
+
+            # The most recent three are cached, the first one was evicted
+            assert validate_signed_message(*_triples[3])
+            assert validate_signed_message(*_triples[0])
+            assert signature_cache_info().hits == 1
+            assert signature_cache_info().misses == 5
+
+            # Failures are never cached
+            _wrong = (_triples[1][0], _message, _triples[2][2])
+            assert not validate_signed_message(*_wrong)
+            assert not validate_signed_message(*_wrong)
+            assert signature_cache_info().misses == 7
+
+            clear_signature_cache()
+            assert signature_cache_info() == (0, 0, 3, 0)
+        finally:
+            disable_signature_cache()
+
+        assert signature_cache_info() == (0, 0, 0, 0)
+
+
+class TestProd(object):
+
+    def test_product_is_valid(self):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(10)]
+        _product = new_product(name='Test Product', producer=_producer, inputs=_inputs)
+
+        assert _producer.is_valid()
+        assert _product.is_valid()
+        assert all(_p.is_valid() for _p in _inputs)
+
+        _product.input_signatures[5] = _product.input_signatures[4]
+        assert not _product.is_valid()
+
+        assert validate_many([_producer] + _inputs) == [True] * 11
+        assert validate_many([_inputs[0], _product, None, _producer]) == [True, False, False, True]
+        assert validate_many([]) == []
+
+        _inputs[0].producer_pub_key = 'ab'
+        assert not _inputs[0]._is_well_formed()
+        with pytest.raises(ValueError):
+            freeze(_inputs[0])
+
+    def test_payload_cache(self):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(3)]
+        _product = new_product(name='Test Product', producer=_producer, inputs=_inputs)
+
+        _payload = _product._payload_bytes()
+        assert _product._payload_bytes() is _payload
+        assert _payload == _product._build_payload().encode('utf-8')
+        assert '_payload_cache' not in _product.to_dict()
+
+        # Changing any payload field, also in place, invalidates the cache
+        _product.input_pub_keys.pop()
+        assert _product._payload() == _product._build_payload()
+        assert not _product.is_valid()
+
+        _product.input_pub_keys.append(_inputs[-1].pub_key)
+        assert _product.is_valid()
+
+        _product.name = 'Renamed'
+        assert 'Renamed' in _product._payload()
+        assert not _product.is_valid()
+
+        _producer.version_minor = 1
+        assert not _producer.is_valid()
+        assert _producer.sign()
+        assert _producer.is_valid()
+
+    def test_sign_with_wrong_keys(self):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(3)]
+        _product = Product(
+            name='Test Product',
+            producer_pub_key=_producer.pub_key,
+            input_pub_keys=[_p.pub_key for _p in _inputs]
+        )
+
+        assert not _product.sign(producer_priv_key=_inputs[0].priv_key, input_priv_keys=[_p.priv_key for _p in _inputs])
+        assert not _product.sign(producer_priv_key=_producer.priv_key, input_priv_keys=[_p.priv_key for _p in _inputs[::-1]])
+        assert not _product.is_valid()
+
+        assert _product.sign(producer_priv_key=_producer.priv_key, input_priv_keys=[_p.priv_key for _p in _inputs])
+        assert _product.is_valid()
+
+
+class TestChain(object):
+
+    def test_validate_chain(self, tmpdir):
+        db = LocalDB(folderpath=str(tmpdir))
+        _producer = Producer(name='Test Producer')
+        _raw = new_product(name='Raw', producer=_producer, inputs=[])
+        _left = new_product(name='Left', producer=_producer, inputs=[_raw])
+        _right = new_product(name='Right', producer=_producer, inputs=[_raw])
+        _missing = new_product(name='Missing', producer=_producer, inputs=[])
+        _final = new_product(name='Final', producer=_producer, inputs=[_left, _right, _missing])
+
+        for _prod in [_producer, _raw, _left, _right, _final]:
+            assert db.post(_prod)
+
+        for _workers in [1, 2]:
+            _report = validate_chain(_final.pub_key, db, workers=_workers, chunksize=2)
+
+            assert list(_report) == [
+                _final.pub_key, _producer.pub_key, _left.pub_key, _right.pub_key, _missing.pub_key, _raw.pub_key
+            ]
+            assert _report[_producer.pub_key].kind == 'producer'
+            assert _report[_raw.pub_key].depth == 2
+            assert not _report[_missing.pub_key].found
+            assert not _report[_missing.pub_key].valid
+            assert all(_node.valid for _key, _node in _report.items() if _key != _missing.pub_key)
+
+        # A RemoteDB is read unchecked, invalid nodes are found but not valid
+        _forged = new_product(name='Forged', producer=_producer, inputs=[])
+        _forged.signature = _raw.signature
+        _top = new_product(name='Top', producer=_producer, inputs=[_final, _forged])
+        with StandInServer() as server, RemoteDB(url=server.url) as rdb:
+            assert all(rdb.post_many([_producer, _raw, _left, _right, _final, _top]))
+            server.records['products'][_forged.pub_key] = {
+                _k: _v for _k, _v in _forged.to_dict().items() if _k != 'priv_key'
+            }
+
+            # The signatures are only checked in the batches for the pool, not on every get
+            with instrument.breakdown() as _breakdown:
+                _report = validate_chain(_final.pub_key, rdb, workers=1)
+            assert 'Product.is_valid' not in _breakdown.timers and 'Producer.is_valid' not in _breakdown.timers
+            assert all(_node.valid for _key, _node in _report.items() if _key != _missing.pub_key)
+
+            _report = validate_chain(_top.pub_key, rdb, workers=1)
+            assert _report[_forged.pub_key].found and not _report[_forged.pub_key].valid
+            assert _report[_final.pub_key].valid
+
+
+class TestLocalDB(object):
+
+    def test_incremental_persistence(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _products = [new_product(name='Product {}'.format(i), producer=_producer, inputs=[]) for i in range(5)]
+        _snapshot = str(tmpdir.join('grafeo_local_db.p'))
+
+        db = LocalDB(folderpath=str(tmpdir))
+        assert all(db.post_many([_producer] + _products[:3]))
+        assert not os.path.exists(_snapshot + '.delta.1')
+        assert db.flush()
+        assert not db.flush()
+
+        # A flush only writes what changed since the last one
+        assert db.post(_products[3])
+        assert db.flush()
+        with open(_snapshot + '.delta.2', 'rb') as _f:
+            assert list(pickle.load(_f)['products']) == [_products[3].pub_key]
+
+        assert LocalDB(folderpath=str(tmpdir)).get_product(_products[3].pub_key) is not None
+
+        # Compaction folds the deltas into the snapshot
+        db.compact()
+        assert os.path.exists(_snapshot) and not os.path.exists(_snapshot + '.delta.1')
+        assert len(LocalDB(folderpath=str(tmpdir)).products()) == 4
+
+        # A compaction which crashed before removing the deltas must not roll back reposted records
+        for _name in ['First', 'Second']:
+            _products[0].name = _name
+            assert _products[0].sign(_producer.priv_key, [])
+            assert db.post(_products[0])
+            if _name == 'First':
+                assert db.flush()
+                with open(_snapshot + '.delta.3', 'rb') as _f:
+                    _folded = _f.read()
+        db.compact()
+        with open(_snapshot + '.delta.3', 'wb') as _f:
+            _f.write(_folded)
+        assert LocalDB(folderpath=str(tmpdir)).get_product(_products[0].pub_key).name == 'Second'
+
+        # Background flushes
+        db = LocalDB(folderpath=str(tmpdir), autoflush=0.01)
+        assert db.post(_products[4])
+        for _ in range(500):
+            if os.path.exists(_snapshot + '.delta.4'):
+                break
+            time.sleep(0.01)
+        db.close()
+        assert len(LocalDB(folderpath=str(tmpdir)).products()) == 5
+
+        # An unreadable delta is moved aside with the later ones, so that new flushes are not ignored
+        assert db.post(_products[1], validate=False) and db.flush()
+        _broken = _delta_files(_snapshot)[-1][1]
+        with open(_broken, 'wb') as _f:
+            _f.write(b'broken')
+        with pytest.warns(UserWarning):
+            db = LocalDB(folderpath=str(tmpdir))
+        assert os.path.exists(_broken + '.unreadable') and not os.path.exists(_broken)
+
+        _other = Producer(name='Other Producer')
+        assert db.post(_other) and db.flush()
+        assert LocalDB(folderpath=str(tmpdir)).get_producer(_other.pub_key) is not None
+
+    def test_downstream(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _other = Producer(name='Other Producer')
+        _raw = new_product(name='Raw', producer=_producer, inputs=[])
+        _left = new_product(name='Left', producer=_other, inputs=[_raw])
+        _right = new_product(name='Right', producer=_other, inputs=[_raw])
+        _final = new_product(name='Final', producer=_producer, inputs=[_left, _right])
+
+        db = LocalDB(folderpath=str(tmpdir))
+        for _prod in [_producer, _other, _raw, _left, _right, _final]:
+            assert db.post(_prod)
+
+        assert db.downstream(_raw.pub_key) == [_left.pub_key, _right.pub_key, _final.pub_key]
+        assert db.downstream(_raw.pub_key, depth=1) == [_left.pub_key, _right.pub_key]
+        assert db.downstream(_final.pub_key) == []
+        assert db.downstream(_other.pub_key) == [_left.pub_key, _right.pub_key, _final.pub_key]
+        assert db.products_by_producer(_producer.pub_key) == [_raw.pub_key, _final.pub_key]
+
+        # Reposting a product with other inputs updates the index
+        _final.input_pub_keys = [_left.pub_key]
+        _final.sign(producer_priv_key=_producer.priv_key, input_priv_keys=[_left.priv_key])
+        assert db.post(_final)
+        assert db.downstream(_right.pub_key) == []
+
+        # The index is rebuilt on load
+        db._exit()
+        db = LocalDB(folderpath=str(tmpdir))
+        assert db.downstream(_left.pub_key) == [_final.pub_key]
+        assert db.products_by_producer(_other.pub_key) == [_left.pub_key, _right.pub_key]
+
+    def test_snapshot(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _products = [new_product(name='Product {}'.format(i), producer=_producer, inputs=[]) for i in range(20)]
+        _final = new_product(name='Final', producer=_producer, inputs=_products)
+        _path = str(tmpdir.join('grafeo.snapshot'))
+
+        db = LocalDB(folderpath=str(tmpdir))
+        assert all(db.post_many([_producer] + _products + [_final]))
+        assert export_snapshot(db, _path) == 22
+
+        with SnapshotDB(_path) as snapshot:
+            assert len(snapshot) == 22
+            for _prod in _products + [_final]:
+                assert snapshot.get_product(_prod.pub_key).to_dict() == dict(_prod.to_dict(), priv_key='')
+            assert snapshot.get_product(_final.pub_key).is_valid()
+            assert snapshot.get_producer(_producer.pub_key).name == 'Test Producer'
+
+            assert snapshot.get_producer(_final.pub_key) is None
+            assert snapshot.get_product(generate_key_pair()['pub_key']) is None
+            assert snapshot.get_product('not a key') is None
+            assert not snapshot.post(_producer)
+
+            _keys = [_p.pub_key for _p in snapshot.products()]
+            assert _keys == sorted(_p.pub_key for _p in _products + [_final])
+
+        with open(_path, 'r+b') as _f:
+            _f.truncate(100)
+        with pytest.raises(ValueError):
+            SnapshotDB(_path)
+
+    def test_frozen(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _input = new_product(name='Input', producer=_producer, inputs=[])
+        _product = new_product(name='Product', producer=_producer, inputs=[_input])
+
+        db = LocalDB(folderpath=str(tmpdir))
+        assert db.post(_producer)
+        assert db.post(_product)
+
+        _frozen = db.get_product(_product.pub_key)
+        assert isinstance(_frozen, FrozenProduct)
+        assert isinstance(db.get_producer(_producer.pub_key), FrozenProducer)
+        assert _frozen is db.get_product(_product.pub_key)
+        assert _frozen.is_valid()
+        assert _frozen.to_dict() == _product.to_dict()
+        assert validate_many([_frozen, db.get_producer(_producer.pub_key)]) == [True, True]
+
+        with pytest.raises(AttributeError):
+            _frozen.name = 'Changed'
+
+        _thawed = _frozen.thaw()
+        assert type(_thawed) is Product
+        assert _thawed.to_dict() == _product.to_dict()
+        _thawed.name = 'Changed'
+        assert _frozen.name == 'Product'
+
+        assert freeze(_frozen) is _frozen
+        assert db.post(_frozen)
+
+        # Keys and signatures are stored as raw bytes
+        assert _frozen._inputs == bytes.fromhex(_input.pub_key + _product.input_signatures[0])
+        assert _frozen.input_pub_keys == (_input.pub_key,)
+        assert _frozen.input_signatures == tuple(_product.input_signatures)
+        assert not hasattr(_frozen, '__dict__') or not _frozen.__dict__
+
+        _thawed.input_signatures = ['not a signature']
+        with pytest.raises(ValueError):
+            freeze(_thawed)
+
+        db._exit()
+        db = LocalDB(folderpath=str(tmpdir))
+        assert db.get_product(_product.pub_key).to_dict() == _product.to_dict()
+
+
+class TestLogDB(object):
+
+    def test_log(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(5)]
+
+        db = LogDB(folderpath=str(tmpdir))
+        assert db.post(_producer)
+        for _p in _inputs:
+            assert db.post(_p)
+        db.close()
+
+        # Records posted after the checkpoint are replayed, a torn one is cut off
+        db = LogDB(folderpath=str(tmpdir))
+        assert db.post(_inputs[0])
+        _size = os.path.getsize(db._filename)
+        db._file.write(b'torn record')
+        db._file.flush()
+
+        db = LogDB(folderpath=str(tmpdir))
+        assert os.path.getsize(db._filename) == _size
+        assert db.get_producer(_producer.pub_key).priv_key == _producer.priv_key
+        assert db.get_product(_inputs[3].pub_key).is_valid()
+        assert db.get_product(_producer.pub_key) is None
+        assert sorted(_p.pub_key for _p in db.products()) == sorted(_p.pub_key for _p in _inputs)
+
+        db.compact()
+        assert os.path.getsize(db._filename) < _size
+        assert db.get_product(_inputs[0].pub_key).is_valid()
+        db.close()
+
+        db = LogDB(folderpath=str(tmpdir))
+        assert len(list(db.products())) == 5
+        assert len(list(db.producers())) == 1
+        db.close()
+
+        # A damaged checkpoint is ignored and the log replayed
+        for _checkpoint in [['not', 'a', 'dict'], {'id': db._id, 'end': 0}]:
+            with open(db._index_filename, 'wb') as _f:
+                pickle.dump(_checkpoint, _f)
+            db = LogDB(folderpath=str(tmpdir))
+            assert len(list(db.products())) == 5
+            db.close()
+
+
+def _post_to_shards(folderpath, producer, count):
+    _inputs = [new_product(name='Input {}'.format(i), producer=producer, inputs=[]) for i in range(count)]
+    with ShardedDB(folderpath, shards=4) as db:
+        assert all(db.post_many(_inputs))
+        for _p in _inputs:
+            assert db.post(_p)
+
+
+class TestShardedDB(object):
+
+    def test_shards(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(20)]
+        _final = new_product(name='Final', producer=_producer, inputs=_inputs)
+
+        with ShardedDB(str(tmpdir), shards=4) as db:
+            assert db.post(_producer)
+            assert db.post_many(_inputs + [_final, Producer(pub_key=_producer.pub_key, name='Wrong')]) == \
+                [True] * 21 + [False]
+            assert len(set(db._shard_index(_p.pub_key) for _p in _inputs)) > 1
+
+            # A second handle on the same folder sees the posts and its own posts are seen
+            with ShardedDB(str(tmpdir), shards=4) as other:
+                assert other.get_product(_final.pub_key).is_valid()
+                _late = new_product(name='Late', producer=_producer, inputs=[_final])
+                assert other.post(_late)
+                other.compact()
+
+            # A reader which reopens the compacted log leaves a torn record to the writers
+            _log = db._shard(_late.pub_key)._filename
+            with open(_log, 'ab') as _f:
+                _f.write(b'torn record')
+            _size = os.path.getsize(_log)
+
+            assert db.get_product(_late.pub_key).to_dict() == _late.to_dict()
+            assert os.path.getsize(_log) == _size
+            assert db.get_producer(_producer.pub_key).priv_key == _producer.priv_key
+            assert db.get_product(_producer.pub_key) is None
+            assert db.get_product('not a key') is None
+            assert len(list(db.products())) == 22
+
+        with pytest.raises(ValueError):
+            ShardedDB(str(tmpdir), shards=8)
+
+    def test_processes(self, tmpdir):
+        _producers = [Producer(name='Producer {}'.format(i)) for i in range(4)]
+        _processes = [
+            multiprocessing.Process(target=_post_to_shards, args=(str(tmpdir), _producer, 50))
+            for _producer in _producers
+        ]
+        for _process in _processes:
+            _process.start()
+        for _process in _processes:
+            _process.join()
+            assert _process.exitcode == 0
+
+        with ShardedDB(str(tmpdir), shards=4) as db:
+            _products = list(db.products())
+            assert len(_products) == 200
+            assert sorted(set(_p.producer_pub_key for _p in _products)) == sorted(_p.pub_key for _p in _producers)
+
+
+class TestSQLiteDB(object):
+
+    def test_sqlite(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _raw = new_product(name='Raw', producer=_producer, inputs=[])
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[_raw]) for i in range(3)]
+        _final = new_product(name='Final', producer=_producer, inputs=_inputs)
+
+        ldb = LocalDB(folderpath=str(tmpdir))
+        assert ldb.post(_producer)
+        assert ldb.post(_raw)
+        ldb._exit()
+
+        with SQLiteDB(os.path.join(str(tmpdir), 'grafeo.sqlite')) as db:
+            assert db.migrate_local_db(str(tmpdir)) == 2
+            assert db.post_many(_inputs + [_final, Producer(pub_key=_raw.pub_key, name='Wrong')]) == [True] * 4 + [False]
+
+            _fetched = db.get_product(_final.pub_key)
+            assert _fetched.is_valid()
+            assert _fetched.to_dict() == _final.to_dict()
+            assert db.get_producer(_producer.pub_key).priv_key == _producer.priv_key
+            assert db.get_product(_producer.pub_key) is None
+            assert db.get_product('not a key') is None
+
+            assert sorted(db.products_with_input(_raw.pub_key)) == sorted(_p.pub_key for _p in _inputs)
+            assert db.products_with_input(_inputs[1].pub_key) == [_final.pub_key]
+            assert db.products_with_input(_final.pub_key) == []
+
+            # Reposting replaces the inputs
+            assert db.post(_final)
+            assert len(db.get_product(_final.pub_key).input_pub_keys) == 3
+            assert len(list(db.products())) == 5
+            assert len(list(db.producers())) == 1
+
+
+class TestJsonl(object):
+
+    def test_export_import(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(5)]
+        _product = new_product(name='Product', producer=_producer, inputs=_inputs)
+
+        ldb = LocalDB(folderpath=str(tmpdir))
+        for _prod in [_producer, _product] + _inputs:
+            assert ldb.post(_prod)
+
+        _path = os.path.join(str(tmpdir), 'export.jsonl')
+        _progress = []
+        _stats = export_jsonl(ldb, _path, progress=_progress.append, progress_every=3)
+        assert (_stats.records, _stats.accepted, _stats.rejected) == (7, 7, 0)
+        assert len(_progress) == 3
+
+        # Tamper with one record and add garbage
+        with open(_path) as _f:
+            _lines = _f.readlines()
+        assert 'priv_key' not in _lines[0]
+        _lines[2] = _lines[2].replace('"Input', '"Changed Input')
+        _lines.append('not json\n')
+        # Without a public key the constructor would sign a brand new producer
+        _lines.append(json.dumps({'kind': 'producer', 'record': {'name': 'Forged'}}) + '\n')
+        with open(_path, 'w') as _f:
+            _f.writelines(_lines)
+
+        for _workers in [1, 2]:
+            with SQLiteDB(os.path.join(str(tmpdir), 'import{}.sqlite'.format(_workers))) as db:
+                _stats = import_jsonl(db, _path, workers=_workers, chunk_size=2)
+                assert (_stats.records, _stats.accepted, _stats.rejected) == (9, 6, 3)
+                assert db.get_product(_product.pub_key).is_valid()
+                assert db.get_producer(_producer.pub_key).priv_key == ''
+
+        # Private keys only on request, export of selected records also works without listing
+        export_jsonl(ldb, _path, pub_keys=[_producer.pub_key, _product.pub_key], private_keys=True)
+        db = LogDB(folderpath=str(tmpdir))
+        assert import_jsonl(db, _path, validate=False).accepted == 2
+        assert db.get_producer(_producer.pub_key).priv_key == _producer.priv_key
+        db.close()
+
+
+class TestCachedDB(object):
+
+    def test_cache(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _product = new_product(name='Product', producer=_producer, inputs=[])
+        _missing = generate_key_pair()['pub_key']
+        _now = [0.0]
+
+        backend = SQLiteDB(str(tmpdir.join('grafeo.db')))
+        assert backend.post(_producer)
+
+        with CachedDB(backend, maxsize=2, ttl=100.0, negative_ttl=10.0, validate=True, clock=lambda: _now[0]) as db:
+            assert db.get_producer(_producer.pub_key).name == 'Test Producer'
+            assert db.get_producer(_producer.pub_key) is db.get_producer(_producer.pub_key)
+            assert db.get_product(_missing) is None
+            assert db.get_product(_missing) is None
+            assert db.info()[:3] == (2, 1, 2)
+            assert db.hit_rate == 3 / 5
+
+            # Misses are only remembered for negative_ttl, records for ttl
+            _now[0] = 11.0
+            assert db.get_product(_missing) is None
+            assert db.info().misses == 3
+            _now[0] = 101.0
+            assert db.get_producer(_producer.pub_key) is not None
+            assert db.info().misses == 4
+
+            # A validated post replaces a remembered miss
+            assert db.get_product(_product.pub_key) is None
+            assert db.post(_product)
+            assert db.get_product(_product.pub_key).pub_key == _product.pub_key
+            assert db.info().currsize == 3
+
+            # Invalid records are never cached, attributes of the backend are reachable
+            _invalid = new_product(name='Invalid', producer=_producer, inputs=[])
+            _invalid.signature = _product.signature
+            assert backend.post(_invalid, validate=False)
+            assert db.get_product(_invalid.pub_key) is None
+            assert db.products_with_input(_product.pub_key) == []
+
+        # A backend which answers with another, validly signed record does not poison the cache
+        class _WrongBackend(SQLiteDB):
+            def get_producer(self, pub_key):
+                return _producer
+
+        with _WrongBackend(str(tmpdir.join('wrong.db'))) as backend, CachedDB(backend, validate=True) as db:
+            _other = Producer(name='Other Producer')
+            assert db.get_producer(_other.pub_key) is None
+            assert db.get_producer(_producer.pub_key).name == 'Test Producer'
+
+
+class TestRemoteDB(object):
+
+    def test_unreachable(self):
+        _producer = Producer(name='Test Producer')
+
+        with RemoteDB(url='http://127.0.0.1:1/', retries=0, timeout=1.0) as db:
+            assert db.url == 'http://127.0.0.1:1'
+            assert db.get_producer(pub_key=_producer.pub_key) is None
+            assert not db.post(_producer)
+
+    def test_get_and_post(self):
+        _producer = Producer(name='Test Producer')
+        _input = new_product(name='Input', producer=_producer, inputs=[])
+        _product = new_product(name='Product', producer=_producer, inputs=[_input])
+
+        with StandInServer() as server, RemoteDB(url=server.url) as db:
+            assert db.post(_producer)
+            assert db.post(_input)
+            assert db.post(_product)
+            assert db.post_product(name='Product 2', producer=_producer, inputs=[_input, _product])
+
+            _fetched = db.get_product(pub_key=_product.pub_key)
+            assert _fetched.is_valid()
+            assert _fetched.input_signatures == _product.input_signatures
+            assert db.get_producer(pub_key=_producer.pub_key).name == 'Test Producer'
+            assert db.get_product(pub_key=_producer.pub_key) is None
+
+            # The server does not keep private keys
+            assert server.records['producers'][_producer.pub_key].get('priv_key') is None
+
+    def test_async(self):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(20)]
+        _missing = generate_key_pair()['pub_key']
+
+        async def _run(url):
+            async with AsyncRemoteDB(url=url, concurrency=4) as db:
+                assert await db.post(_producer)
+                assert all(await asyncio.gather(*[db.post(_p) for _p in _inputs]))
+                assert await db.post_product(name='Product', producer=_producer, inputs=_inputs)
+
+                _fetched = await db.gather_products([_p.pub_key for _p in _inputs] + [_missing])
+                assert [_p.pub_key for _p in _fetched[:-1]] == [_p.pub_key for _p in _inputs]
+                assert _fetched[-1] is None
+
+                assert (await db.get_producer(_producer.pub_key)).is_valid()
+
+        with StandInServer() as server:
+            _loop = asyncio.new_event_loop()
+            try:
+                _loop.run_until_complete(_run(server.url))
+            finally:
+                _loop.close()
+            assert len(server.records['products']) == 21
+
+            # The client outlives a loop, a new loop gets its own semaphore
+            _db = AsyncRemoteDB(url=server.url, concurrency=2)
+            try:
+                for _ in range(2):
+                    _loop = asyncio.new_event_loop()
+                    try:
+                        _fetched = _loop.run_until_complete(_db.gather_products([_p.pub_key for _p in _inputs]))
+                    finally:
+                        _loop.close()
+                    assert all(_p is not None for _p in _fetched)
+            finally:
+                _db.close()
+
+    def test_many(self):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(7)]
+        _invalid = new_product(name='Invalid', producer=_producer, inputs=[])
+        _invalid.signature = _inputs[0].signature
+        _missing = generate_key_pair()['pub_key']
+
+        for _bulk in [True, False]:
+            with StandInServer(bulk=_bulk) as server, RemoteDB(url=server.url, chunk_size=3) as db:
+                assert db.post_many([_producer, _inputs[0], _invalid] + _inputs[1:]) == [True, True, False] + [True] * 6
+                assert db._bulk is _bulk
+                assert len(server.records['products']) == 7
+                assert server.store_many('producers', Producer, [{'name': 'Forged'}, None]) == [False, False]
+
+                _keys = [_p.pub_key for _p in _inputs]
+                _fetched = db.get_many_products(_keys + [_missing, _invalid.pub_key, 'not a key'])
+                assert [_p.pub_key for _p in _fetched[:7]] == _keys
+                assert _fetched[7:] == [None, None, None]
+                assert all(_p.is_valid() for _p in _fetched[:7])
+
+                assert db.get_many_producers([_producer.pub_key, _keys[0]])[0].name == 'Test Producer'
+                assert db.get_many_producers([_producer.pub_key, _keys[0]])[1] is None
+
+    def test_binary_wire(self):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(5)]
+        _product = new_product(name='Product', producer=_producer, inputs=_inputs)
+
+        for _binary in [True, False]:
+            with StandInServer(binary=_binary) as server, RemoteDB(url=server.url, wire='binary') as db:
+                assert db.post(_producer)
+                assert db._binary is _binary
+                assert db.post_many(_inputs + [_product]) == [True] * 6
+
+                assert db.get_product(_product.pub_key).to_dict() == dict(_product.to_dict(), priv_key='')
+                assert db.get_product(_producer.pub_key) is None
+                assert [_p.pub_key for _p in db.get_many_products([_product.pub_key, _inputs[0].pub_key])] == \
+                    [_product.pub_key, _inputs[0].pub_key]
+
+    def test_disk_cache(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(4)]
+        _cache_dir = str(tmpdir.join('cache'))
+
+        with StandInServer() as server:
+            with RemoteDB(url=server.url, cache_dir=_cache_dir) as db:
+                assert db.post(_producer)
+                assert db.post_many(_inputs[:2], validate=False) == [True, True]
+                for _input in _inputs[2:]:
+                    server.store('products', Product, _input.to_dict())
+                assert db.get_product(_inputs[2].pub_key) is not None
+                assert db.get_many_products([_inputs[3].pub_key])[0] is not None
+
+        # A warm start needs neither the server nor signature checks
+        with RemoteDB(url=server.url, cache_dir=_cache_dir, retries=0, timeout=1.0) as db:
+            assert db.get_producer(_producer.pub_key).to_dict() == dict(_producer.to_dict(), priv_key='')
+            assert [_p is not None for _p in db.get_many_products([_p.pub_key for _p in _inputs])] == \
+                [False, False, True, True]
+            assert db.get_product(_producer.pub_key) is None
+            assert db.get_product(None) is None
+            assert db.get_many_products([None, 'not a key']) == [None, None]
+
+        async def _get_malformed():
+            async with AsyncRemoteDB(url=server.url, cache_dir=_cache_dir, retries=0) as db:
+                return await db.get_product(None)
+
+        _loop = asyncio.new_event_loop()
+        try:
+            assert _loop.run_until_complete(_get_malformed()) is None
+        finally:
+            _loop.close()
+
+        # The least recently used records are evicted first
+        _cache = DiskCache(_cache_dir, max_bytes=500)
+        assert _cache.get(Product, _inputs[2].pub_key) is not None
+        _cache.put(_inputs[0])
+        assert _cache.size() <= 500
+        assert _cache.get(Producer, _producer.pub_key) is None
+        assert _cache.get(Product, _inputs[3].pub_key) is None
+        assert _cache.get(Product, _inputs[2].pub_key) is not None
+        _cache.close()
+
+    def test_lazy(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        _input = new_product(name='Input', producer=_producer, inputs=[])
+        _product = new_product(name='Product', producer=_producer, inputs=[_input])
+        _forged = new_product(name='Forged', producer=_producer, inputs=[])
+        _forged.producer_signature = _input.producer_signature
+
+        with StandInServer() as server, RemoteDB(url=server.url, lazy=True) as db:
+            assert db.post_many([_producer, _input, _product]) == [True] * 3
+            server.records['products'][_forged.pub_key] = {
+                _k: _v for _k, _v in _forged.to_dict().items() if _k != 'priv_key'
+            }
+
+            _lazy = db.get_product(_product.pub_key)
+            assert isinstance(_lazy, LazyRecord) and isinstance(_lazy, Product)
+            assert _lazy.name == 'Product' and not _lazy.verified
+            assert _lazy.input_pub_keys == [_input.pub_key]
+            assert _lazy.verified and _lazy.is_valid()
+            with pytest.raises(AttributeError):
+                _lazy.name = 'Other'
+
+            _lazy = db.get_product(_forged.pub_key)
+            assert _lazy.name == 'Forged' and str(_lazy) == 'Product: Forged'
+            with pytest.raises(InvalidRecordError):
+                _lazy.producer_signature
+            assert not _lazy.is_valid() and not _lazy.verify()
+
+            _many = db.get_many_products([_product.pub_key, _forged.pub_key, _producer.pub_key])
+            assert _many[2] is None
+            assert [_p.verified for _p in _many[:2]] == [False, False]
+            assert [_p.is_valid() for _p in _many[:2]] == [True, False]
+
+            # Proxies can be pickled, e.g. into a log or to worker processes
+            _copy = pickle.loads(pickle.dumps(db.get_product(_forged.pub_key)))
+            assert isinstance(_copy, LazyRecord) and not _copy.verified and not _copy.is_valid()
+            assert all(_node.valid for _node in validate_chain(_product.pub_key, db, workers=2).values())
+            ldb = LogDB(folderpath=str(tmpdir))
+            assert ldb.post(_many[0])
+            assert type(ldb.get_product(_product.pub_key)) is Product
+            ldb.close()
+
+            # Strict is the default
+            with RemoteDB(url=server.url) as _strict:
+                assert _strict.get_product(_forged.pub_key) is None
+
+            # Records under another key and records without a key are dropped in every mode
+            _wrong = generate_key_pair()['pub_key']
+            server.records['products'][_wrong] = server.records['products'][_product.pub_key]
+            server.records['producers'][_wrong] = {'name': 'Forged'}
+            with RemoteDB(url=server.url) as _strict:
+                for _db in [db, _strict]:
+                    assert _db.get_product(_wrong) is None
+                    assert _db.get_producer(_wrong) is None
+                    assert _db.get_many_products([_wrong]) == [None]
+
+
+class TestWire(object):
+
+    def test_roundtrip(self):
+        _producer = Producer(name='Pr\u00f6ducer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(3)]
+        _product = new_product(name='Product', producer=_producer, inputs=_inputs)
+
+        for _prod in [_producer, _inputs[0], _product, freeze(_product)]:
+            _decoded = wire.decode(wire.encode(_prod))
+            assert _decoded.to_dict() == dict(_prod.to_dict(), priv_key='')
+            assert _decoded.is_valid()
+
+        _batch = wire.decode_batch(wire.encode_batch([_product, None, _producer]))
+        assert _batch[0].pub_key == _product.pub_key and _batch[1] is None and _batch[2].name == _producer.name
+        assert wire.decode_batch(wire.encode_batch([])) == []
+
+    def test_malformed(self):
+        _producer = Producer(name='Test Producer')
+        _product = new_product(name='Product', producer=_producer, inputs=[])
+        _encoded = wire.encode(_product)
+
+        for _buffer in [b'', _encoded[:-1], _encoded + b'x', b'\x07' + _encoded[1:]]:
+            with pytest.raises(ValueError):
+                wire.decode(_buffer)
+
+        with pytest.raises(ValueError):
+            wire.decode_batch(wire.encode_batch([_product])[:-1])
+
+        _product.signature = 'not hex'
+        with pytest.raises(ValueError):
+            wire.encode(_product)
+
+        # Short keys would otherwise be padded with zeros
+        for _values in [['ab'], [_producer.pub_key, 'ab'], [_producer.pub_key + 'ab']]:
+            with pytest.raises(ValueError):
+                wire._raw(_values, 32)
+        assert wire._raw([_producer.pub_key] * 2, 32) == bytes.fromhex(_producer.pub_key) * 2
+
+    def test_size(self):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(100)]
+        _product = new_product(name='Product', producer=_producer, inputs=_inputs)
+
+        _json = json.dumps(dict(_product.to_dict(), priv_key='')).encode('utf-8')
+        assert len(wire.encode(_product)) < 0.55 * len(_json)
+
+
+class TestInstrument(object):
+
+    def test_sinks(self, caplog):
+        _producer = Producer(name='Test Producer')
+        _inputs = [new_product(name='Input {}'.format(i), producer=_producer, inputs=[]) for i in range(3)]
+
+        sink = instrument.HistogramSink()
+        _product = new_product(name='Product', producer=_producer, inputs=_inputs)
+        assert not instrument.is_enabled()
+
+        _logging_sink = instrument.LoggingSink()
+        instrument.add_sink(sink)
+        instrument.add_sink(_logging_sink)
+        try:
+            with caplog.at_level('DEBUG', logger='grafeo.instrument'):
+                _product.sign(producer_priv_key=_producer.priv_key, input_priv_keys=[_p.priv_key for _p in _inputs])
+                assert _product.is_valid()
+        finally:
+            instrument.remove_sink(_logging_sink)
+            instrument.remove_sink(sink)
+
+        assert not instrument.is_enabled()
+        assert _product.is_valid()
+
+        _summary = sink.summary()
+        assert _summary['Product.is_valid']['count'] == 1
+        assert _summary['crypto.verify']['count'] == 5
+        assert _summary['crypto.sign_many']['count'] == 1
+        assert sink.counters['crypto.signatures'] == 5
+        assert any('crypto.verify took' in _r.getMessage() for _r in caplog.records)
+
+        _text = sink.prometheus_text()
+        assert 'grafeo_seconds_count{name="crypto.verify"} 5' in _text
+        assert 'grafeo_seconds_bucket{name="crypto.verify",le="+Inf"} 5' in _text
+        assert 'grafeo_total{name="crypto.signatures"} 5' in _text
+
+    def test_breakdown(self, tmpdir):
+        _producer = Producer(name='Test Producer')
+        db = LocalDB(folderpath=str(tmpdir))
+
+        with instrument.breakdown() as _breakdown:
+            assert db.post(_producer)
+
+        assert not instrument.is_enabled()
+        assert set(_breakdown.timers) >= {'LocalDB.post', 'Producer.is_valid', 'crypto.verify'}
+        assert _breakdown.timers['LocalDB.post'][1] <= _breakdown.seconds
+        assert _breakdown.report().splitlines()[1].startswith('LocalDB.post')
@@ -0,0 +1,200 @@
+"""Compact binary serialization of producers and products
+
+A record is a fixed layout of big-endian fields with keys and signatures as
+raw bytes:
+
+    kind (1 byte, 0 = producer, 1 = product)
+    version_major, version_minor, version_patch (4 bytes each)
+    pub_key (32 bytes), signature (64 bytes)
+    length of the utf-8 name (2 bytes), name
+
+and for products additionally
+
+    producer_pub_key (32 bytes), producer_signature (64 bytes)
+    number of inputs n (4 bytes), n input keys (32 bytes each), n input signatures (64 bytes each)
+
+Private keys are never serialized. A batch frame carries many records in one
+buffer: a magic, the number of records n, n + 1 offsets into the frame and the
+records themselves. Thanks to the offset table single records can be decoded
+without parsing the others, an empty record stands for None.
+"""
+
+import struct
+
+from typing import Iterator, List, Optional, Sequence
+from . import BaseProd, Producer, Product
+
+
+"""Content type of records and batch frames in http requests"""
+CONTENT_TYPE = 'application/x-grafeo'
+
+_PRODUCER, _PRODUCT = 0, 1
+
+_HEAD = struct.Struct('>BIII32s64sH')
+_PRODUCT_HEAD = struct.Struct('>32s64sI')
+
+_FRAME_MAGIC = b'GRFB\x01'
+_COUNT = struct.Struct('>I')
+
+
+def _raw(hex_strings: Sequence[str], size: int) -> bytes:
+    """Converts hex keys or signatures to bytes, struct would silently pad short ones with zeros
+
+    :raises ValueError: unless every string is exactly size bytes
+    """
+
+    _raw_bytes = bytes.fromhex(''.join(hex_strings))  # type: bytes
+    if len(_raw_bytes) != size * len(hex_strings) or any(len(_s) != 2 * size for _s in hex_strings):
+        raise ValueError('Keys have to be 32 and signatures 64 bytes long')
+
+    return _raw_bytes
+
+
+def encode(prod: BaseProd) -> bytes:
+    """Serializes a well formed producer or product
+
+    :raises ValueError: if prod can not be serialized
+    """
+
+    if not isinstance(prod, (Producer, Product)) or not prod._is_well_formed():
+        raise ValueError('Only well formed producers and products can be serialized')
+
+    _name = prod.name.encode('utf-8')  # type: bytes
+
+    try:
+        _head = _HEAD.pack(
+            _PRODUCER if isinstance(prod, Producer) else _PRODUCT,
+            prod.version_major,
+            prod.version_minor,
+            prod.version_patch,
+            _raw([prod.pub_key], 32),
+            _raw([prod.signature], 64),
+            len(_name)
+        )  # type: bytes
+    except struct.error as _e:
+        raise ValueError(str(_e))
+
+    if isinstance(prod, Producer):
+        return _head + _name
+
+    _input_pub_keys = prod.input_pub_keys or []  # type: List[str]
+
+    return b''.join([
+        _head,
+        _name,
+        _PRODUCT_HEAD.pack(
+            _raw([prod.producer_pub_key], 32),
+            _raw([prod.producer_signature], 64),
+            len(_input_pub_keys)
+        ),
+        _raw(_input_pub_keys, 32),
+        _raw(prod.input_signatures or [], 64)
+    ])
+
+
+def decode(buffer: bytes) -> BaseProd:
+    """Deserializes a record written by encode
+
+    :returns a mutable Producer or Product without private key
+    :raises ValueError: if the buffer is no valid record
+    """
+
+    _buffer = memoryview(buffer)
+
+    try:
+        _kind, _major, _minor, _patch, _pub_key, _signature, _name_length = _HEAD.unpack_from(_buffer)
+        _offset = _HEAD.size + _name_length  # type: int
+        _name = bytes(_buffer[_HEAD.size:_offset]).decode('utf-8')  # type: str
+
+        if _kind == _PRODUCER:
+            if _offset != len(_buffer):
+                raise ValueError('Trailing bytes after producer')
+
+            return Producer(
+                pub_key=_pub_key.hex(),
+                version_major=_major,
+                version_minor=_minor,
+                version_patch=_patch,
+                name=_name,
+                signature=_signature.hex()
+            )
+
+        if _kind != _PRODUCT:
+            raise ValueError('Unknown record kind {}'.format(_kind))
+
+        _producer_pub_key, _producer_signature, _num_inputs = _PRODUCT_HEAD.unpack_from(_buffer, _offset)
+        _keys = _offset + _PRODUCT_HEAD.size  # type: int
+        _signatures = _keys + 32 * _num_inputs  # type: int
+
+        if _signatures + 64 * _num_inputs != len(_buffer):
+            raise ValueError('Record has the wrong length')
+
+        return Product(
+            pub_key=_pub_key.hex(),
+            version_major=_major,
+            version_minor=_minor,
+            version_patch=_patch,
+            name=_name,
+            signature=_signature.hex(),
+            producer_pub_key=_producer_pub_key.hex(),
+            producer_signature=_producer_signature.hex(),
+            input_pub_keys=[bytes(_buffer[_i:_i + 32]).hex() for _i in range(_keys, _signatures, 32)],
+            input_signatures=[
+                bytes(_buffer[_i:_i + 64]).hex() for _i in range(_signatures, _signatures + 64 * _num_inputs, 64)
+            ]
+        )
+
+    except (struct.error, UnicodeDecodeError) as _e:
+        raise ValueError(str(_e))
+
+
+def encode_batch(prods: Sequence[Optional[BaseProd]]) -> bytes:
+    """Serializes many produc(er/t)s into one frame, None entries are kept as None"""
+
+    _records = [b'' if _prod is None else encode(_prod) for _prod in prods]  # type: List[bytes]
+
+    _offsets = [0] * (len(_records) + 1)  # type: List[int]
+    _offset = len(_FRAME_MAGIC) + _COUNT.size * (len(_records) + 2)  # type: int
+    for _i, _record in enumerate(_records):
+        _offsets[_i] = _offset
+        _offset += len(_record)
+    _offsets[-1] = _offset
+
+    return b''.join([
+        _FRAME_MAGIC,
+        _COUNT.pack(len(_records)),
+        struct.pack('>{}I'.format(len(_offsets)), *_offsets)
+    ] + _records)
+
+
+def iter_batch(buffer: bytes) -> Iterator[Optional[BaseProd]]:
+    """Deserializes the records of a frame one after the other
+
+    :raises ValueError: if the buffer is no valid frame
+    """
+
+    _buffer = memoryview(buffer)
+
+    if bytes(_buffer[:len(_FRAME_MAGIC)]) != _FRAME_MAGIC:
+        raise ValueError('Not a grafeo batch frame')
+
+    try:
+        _count, = _COUNT.unpack_from(_buffer, len(_FRAME_MAGIC))
+        _offsets = struct.unpack_from('>{}I'.format(_count + 1), _buffer, len(_FRAME_MAGIC) + _COUNT.size)
+    except struct.error as _e:
+        raise ValueError(str(_e))
+
+    if _offsets[-1] != len(_buffer):
+        raise ValueError('Frame has the wrong length')
+
+    for _start, _end in zip(_offsets, _offsets[1:]):
+        if _end < _start:
+            raise ValueError('Frame offsets are not ordered')
+
+        yield decode(_buffer[_start:_end]) if _end > _start else None
+
+
+def decode_batch(buffer: bytes) -> List[Optional[BaseProd]]:
+    """Deserializes all records of a frame written by encode_batch"""
+
+    return list(iter_batch(buffer))
@@ -12,6 +12,7 @@ setup(
     install_requires=[
           'pynacl',
           'requests',
+          'urllib3',
       ],
     keywords = [],
     classifiers = [],